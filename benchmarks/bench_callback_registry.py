@@ -0,0 +1,63 @@
+"""Prefix lookups of the callback registry and the memory retained across reruns."""
+import time
+
+import numpy as np
+
+from seedoo.streamlit.callback_registry import CallbackRegistry
+
+
+def benchmark(callbacks: int = 20_000, lookups: int = 2_000) -> None:
+    """Prefix lookups and removals against the substring scan over a plain dict they replace."""
+    keys = [f'table_row_{row}_button' for row in range(callbacks)]
+    plain = {key: (print, time.time()) for key in keys}
+    registry = CallbackRegistry(max_per_user=callbacks)
+    for key in keys:
+        registry.register('user', key, print)
+
+    start = time.perf_counter()
+    for row in range(lookups):
+        fragment = f'table_row_{row * 7 % callbacks}_'
+        [key for key in plain if fragment in key]
+    scan = (time.perf_counter() - start) / lookups * 1000
+
+    start = time.perf_counter()
+    for row in range(lookups):
+        registry.with_prefix('user', f'table_row_{row * 7 % callbacks}_')
+    indexed = (time.perf_counter() - start) / lookups * 1000
+
+    start = time.perf_counter()
+    for row in range(lookups):
+        registry.remove_prefix('user', f'table_row_{row}_')
+    removal = (time.perf_counter() - start) / lookups * 1000
+
+    print(f'{callbacks} callbacks: substring scan {scan:.3f} ms, prefix lookup {indexed:.4f} ms, '
+          f'prefix removal {removal:.4f} ms per call')
+
+
+def rerun_benchmark(reruns: int = 50, rows: int = 1_000) -> None:
+    """Reruns re-registering one button per row, each closure holding its row, with and without generations."""
+    for scoped in (False, True):
+        registry = CallbackRegistry(max_per_user=10 ** 9)
+        for run in range(reruns):
+            for row in range(rows):
+                payload = np.zeros(128)
+
+                def callback(message, payload=payload):
+                    return payload
+
+                # Keys that change across reruns, as for rows of a table whose order or filter changed
+                key = f'row_{run * rows + row}'
+                if scoped:
+                    registry.register('user', key, callback, scope='session', generation=run)
+                else:
+                    registry.register('user', key, callback)
+        report = registry.memory_report()
+        print(f'{"with generations" if scoped else "without generations":<20} '
+              f'{report["totals"]["callbacks"]:>7} callbacks, '
+              f'{report["totals"]["retained_bytes"] / 2 ** 20:8.1f} MB retained, '
+              f'{report["totals"]["replaced"]} replaced')
+
+
+if __name__ == "__main__":
+    benchmark()
+    rerun_benchmark()
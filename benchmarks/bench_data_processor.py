@@ -0,0 +1,83 @@
+"""Cell dispatch, column width estimation and paged rerun time of process_dataframe, in Streamlit bare mode."""
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from seedoo.streamlit.utils.data_processor import (PER_CELL, LazyRow, build_dispatch_plan, call_function,
+                                                   decide_length, estimate_column_widths, process_dataframe)
+
+
+def dispatch_benchmark(columns: int = 50, rows: int = 1_000, repeat: int = 3) -> None:
+    """Per-cell dispatch over iterrows versus the dispatch plan, with a no-op function and no rendering."""
+    frame = pd.DataFrame({f'c{i}': (np.arange(rows) if i % 3 == 0 else np.random.rand(rows) if i % 3 == 1
+                                    else [f'v{j}' for j in range(rows)]) for i in range(columns)})
+    # Resolved from a local table, the functions registered in the process are left alone
+    functions = {t: {'function': lambda value, row, disabled: value, 'component': None, 'cache': None}
+                 for t in (int, float, str, np.float64)}
+    col_names = list(frame.columns)
+
+    def legacy():
+        for _, row in frame.iterrows():
+            for column in col_names:
+                value = row[column]
+                column_type = type(value)
+                if column in functions:
+                    call_function(functions[column], value, row, False)
+                elif column_type in functions:
+                    call_function(functions[column_type], value, row, False)
+
+    def planned():
+        plan = build_dispatch_plan(frame, col_names, functions)
+        column_values = {column: values for column, values, _ in plan}
+        for position in range(len(frame)):
+            row = LazyRow(frame, position, column_values)
+            for column, values, handler in plan:
+                value = values[position]
+                handler = functions.get(type(value)) if handler is PER_CELL else handler
+                if handler is not None:
+                    call_function(handler, value, row, False)
+
+    for name, fn in (('iterrows + per-cell lookup', legacy), ('dispatch plan', planned)):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f'{columns} columns x {rows} rows, {name:<26} {min(timings):8.2f} ms')
+
+
+def rerun_benchmark() -> None:
+    """Rerun time of a paginated table versus row count."""
+
+    def legacy_widths(df):
+        return [np.rint(np.mean([decide_length(c) for c in df[col].values])) for col in df.columns]
+
+    for rows in (1_000, 10_000, 100_000, 1_000_000):
+        frame = pd.DataFrame({
+            'id': np.arange(rows),
+            'score': np.random.rand(rows),
+            'name': [f'name {i}' for i in range(rows)],
+            'tags': [['a', 'b']] * rows,
+        })
+        start = time.perf_counter()
+        legacy_widths(frame)
+        legacy = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        estimate_column_widths(frame, list(frame.columns))
+        estimated = (time.perf_counter() - start) * 1000
+
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            process_dataframe(frame, filter=True, key='benchmark')
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f'{rows:>9} rows: paged rerun {min(timings):7.2f} ms, widths over all rows: '
+              f'per-value {legacy:9.2f} ms, dtype + sample {estimated:6.2f} ms')
+
+
+if __name__ == "__main__":
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    dispatch_benchmark()
+    rerun_benchmark()
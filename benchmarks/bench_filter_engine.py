@@ -0,0 +1,33 @@
+"""First evaluation versus cached page slices on a 10M-row frame, with and without indexes."""
+import time
+
+import numpy as np
+import pandas as pd
+
+from seedoo.streamlit.utils.filter_engine import INDEX_HASH, INDEX_SORTED, FilterEngine
+
+
+def benchmark(rows: int = 10_000_000) -> None:
+    frame = pd.DataFrame({'id': np.arange(rows), 'x': np.random.rand(rows),
+                          'cat': np.random.choice(['a', 'b', 'c'], rows)})
+    queries = ['x > 0.5 and id < 5000000', '0.2 <= x < 0.3', 'cat == "b" and x > 0.9']
+    for indexes in ({}, {'id': INDEX_SORTED, 'x': INDEX_SORTED, 'cat': INDEX_HASH}):
+        engine = FilterEngine(indexes=indexes)
+        for query in queries:
+            start = time.perf_counter()
+            engine.positions(frame, query, version=1)
+            first = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            for page_number in range(100):
+                page, total = engine.page(frame, query, page_number * 50, 50, version=1)
+            paged = (time.perf_counter() - start) * 10
+            assert page.equals(frame.query(query).iloc[99 * 50:100 * 50])
+            print(f'indexed={bool(indexes)!s:<5} {query:<28} first: {first:8.1f} ms, page: {paged:6.3f} ms, '
+                  f'matches: {total}')
+    start = time.perf_counter()
+    frame.iloc[:50]
+    print(f'plain slice: {(time.perf_counter() - start) * 1000:.3f} ms')
+
+
+if __name__ == "__main__":
+    benchmark()
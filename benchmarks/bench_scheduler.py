@@ -0,0 +1,48 @@
+"""Latency of light users while one user floods the pool, with and without the fair scheduler."""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from seedoo.streamlit.scheduler import FairScheduler
+
+
+def benchmark(workers: int = 8, job_ms: float = 10, spam: int = 2_000, users: int = 10,
+              requests_per_user: int = 10) -> None:
+    """One user floods the pool while others send a few requests, with and without the scheduler."""
+    def job():
+        time.sleep(job_ms / 1000)
+
+    async def scenario(scheduled: bool):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(workers)
+        scheduler = FairScheduler(max_concurrency=workers, per_user=workers, max_queue_per_user=spam,
+                                  max_queued=spam * 2, reserved_ui=0)
+        latencies = []
+
+        async def request(user):
+            start = time.perf_counter()
+            if scheduled:
+                await scheduler.run(user, 'job', lambda: loop.run_in_executor(executor, job))
+            else:
+                await loop.run_in_executor(executor, job)
+            if user != 'spammer':
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        tasks = [asyncio.create_task(request('spammer')) for _ in range(spam)]
+        await asyncio.sleep(0.05)
+        for _ in range(requests_per_user):
+            tasks.extend(asyncio.create_task(request(f'user_{user}')) for user in range(users))
+            await asyncio.sleep(job_ms / 1000)
+        await asyncio.gather(*tasks)
+        executor.shutdown()
+        latencies.sort()
+        name = 'fair scheduler' if scheduled else 'shared pool, FIFO'
+        print(f'{name:<18} other users p50 {latencies[len(latencies) // 2]:8.1f} ms, '
+              f'p99 {latencies[int(len(latencies) * 0.99)]:8.1f} ms')
+
+    asyncio.run(scenario(False))
+    asyncio.run(scenario(True))
+
+
+if __name__ == "__main__":
+    benchmark()
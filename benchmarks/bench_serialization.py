@@ -0,0 +1,35 @@
+"""Encode time and payload size of 1M-element arrays for each push encoding."""
+import time
+
+import numpy as np
+
+from seedoo.streamlit.serialization import ENCODINGS, ENCODING_MSGPACK, decode, encode
+
+
+def measure(name, data, encoding, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        payload = encode(data, encoding)
+        duration = (time.perf_counter() - start) * 1000
+        best = duration if best is None else min(best, duration)
+    print(f'{name:<10} {encoding:<8} encode: {best:9.2f} ms, size: {len(payload) / 1e6:8.2f} MB')
+
+
+def benchmark(size=1_000_000):
+    arrays = {
+        'uint8': np.random.randint(0, 255, size, dtype=np.uint8),
+        'int32': np.random.randint(-2 ** 31, 2 ** 31 - 1, size, dtype=np.int32),
+        'float32': np.random.rand(size).astype(np.float32),
+        'float64': np.random.rand(size),
+    }
+    for name, array in arrays.items():
+        data = {'id': 'benchmark', 'event': 'array', 'data': array}
+        for encoding in ENCODINGS:
+            measure(name, data, encoding)
+        roundtrip = decode(encode(data, ENCODING_MSGPACK))['data']
+        assert np.array_equal(roundtrip, array) and roundtrip.dtype == array.dtype
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,75 @@
+"""Mixed reads and read-modify-write updates from many threads, single lock LRU versus ShardedTTLStore."""
+import collections
+import random
+import threading
+import time
+
+from seedoo.streamlit.sharded_store import ShardedTTLStore
+
+
+class _LockedLRU:
+    """Single lock LRU checking expiry on read, the baseline for the benchmark."""
+
+    def __init__(self, capacity: int, max_age: float):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= now:
+                return default
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def update(self, key, fn, default_factory=None):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            value = fn(entry[0] if entry is not None else default_factory())
+            self.entries[key] = (value, now + self.max_age)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            return value
+
+
+def benchmark(threads: int = 100, operations: int = 2_000, keys: int = 5_000, write_ratio: float = 0.2) -> None:
+    """Mixed reads and read-modify-write updates from many threads against both stores."""
+    def run(store, name):
+        for key in range(keys):
+            store.update(key, lambda state: state, dict)
+        barrier = threading.Barrier(threads + 1)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            barrier.wait()
+            for _ in range(operations):
+                key = rng.randrange(keys)
+                if rng.random() < write_ratio:
+                    store.update(key, lambda state: {**state, 'hits': state.get('hits', 0) + 1}, dict)
+                else:
+                    store.get(key)
+            # One shared counter per thread checks that no update is lost
+            store.update('counter', lambda count: count + 1, int)
+
+        workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        duration = time.perf_counter() - start
+        assert store.get('counter') == threads
+        print(f'{name:<34} {threads * operations / duration:12,.0f} ops/s ({duration:.2f} s)')
+
+    run(_LockedLRU(capacity=keys * 2, max_age=86400), 'single lock LRU')
+    run(ShardedTTLStore(capacity=keys * 2, max_age=86400), 'sharded store, timing wheel')
+
+
+if __name__ == "__main__":
+    benchmark()
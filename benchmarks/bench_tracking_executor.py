@@ -0,0 +1,40 @@
+"""Cancellation accuracy of the executor deadlines under many short tasks."""
+import logging
+import time
+from concurrent.futures import as_completed
+
+from seedoo.streamlit.tracking_executor import ThreadInterrupted, TrackingThreadPoolExecutor, current_token
+
+
+def cooperative_task(n, overruns=None):
+    token = current_token()
+    try:
+        for _ in range(n):
+            token.sleep(0.01)
+    except ThreadInterrupted:
+        if overruns is not None:
+            overruns.append(time.monotonic() - token.deadline)
+        raise
+    return n
+
+
+def stress(tasks=10_000, timeout=0.05):
+    """Runs many short tasks, a tenth of which outlive their deadline, and reports cancellation accuracy."""
+    with TrackingThreadPoolExecutor(max_workers=64, timeout=timeout) as executor:
+        overruns = []
+        start = time.monotonic()
+        futures = [executor.submit(cooperative_task, 20 if i % 10 == 0 else 1, overruns) for i in range(tasks)]
+        completed = cancelled = 0
+        for future in as_completed(futures):
+            if isinstance(future.exception(), ThreadInterrupted):
+                cancelled += 1
+            else:
+                completed += 1
+        duration = time.monotonic() - start
+    print(f'{tasks} tasks in {duration:.2f} s, completed: {completed}, cancelled at deadline: {cancelled}, '
+          f'max overrun past deadline: {max(overruns, default=0) * 1000:.1f} ms')
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    stress()
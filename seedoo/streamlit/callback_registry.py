@@ -0,0 +1,357 @@
+import bisect
+import collections
+import functools
+import inspect
+import sys
+import threading
+import time
+import types
+import weakref
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+
+class _Entry:
+    __slots__ = ('callback', 'weak', 'registered_at', 'used_at', 'scope', 'generation')
+
+    def __init__(self, callback, weak: bool, now: float, scope: Hashable, generation: Optional[int]):
+        self.callback = callback  # the callback, or a weak reference to it
+        self.weak = weak
+        self.registered_at = now
+        self.used_at = now
+        self.scope = scope
+        self.generation = generation
+
+    def resolve(self) -> Optional[Callable]:
+        return self.callback() if self.weak else self.callback
+
+
+class _Scope:
+    __slots__ = ('marker', 'generation', 'keys')
+
+    def __init__(self, marker: Hashable):
+        self.marker = marker  # identifies the run that registered the current generation
+        self.generation = 0
+        self.keys: Dict[int, Set[str]] = {0: set()}  # generation -> keys registered in it
+
+
+class _UserCallbacks:
+    __slots__ = ('entries', 'keys', 'scopes')
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()  # key -> _Entry, least recently used first
+        self.keys = []  # the same keys, sorted, so keys sharing a prefix are one contiguous run
+        self.scopes: Dict[Hashable, _Scope] = {}
+
+
+class CallbackRegistry:
+    """
+    Callbacks of websocket components, indexed by user and key.
+
+    Keys of a user are kept sorted next to the dict that holds the callbacks, so every key starting with
+    a prefix is found with two binary searches. Lookups and bulk removals by prefix cost
+    O(log n + matches) instead of a substring scan over all callbacks of the user.
+
+    Callbacks do not live forever:
+        - Registrations carry a scope (the Streamlit session) and a generation marker (the script run).
+          When a scope registers with a new marker, callbacks of its older generations are dropped, keeping
+          the last `keep_generations`, so buttons that were not rendered again stop holding their closures.
+        - Callbacks not registered or used for `ttl` seconds expire.
+        - Each user keeps at most `max_per_user` callbacks, the least recently used are evicted.
+        - With weak=True only a weak reference is kept and the callback disappears with its referent.
+    """
+
+    def __init__(self, max_per_user: int = 10_000, ttl: float = 86400, keep_generations: int = 2):
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        self.keep_generations = max(1, keep_generations)
+        self._lock = threading.Lock()
+        self._users: Dict[Hashable, _UserCallbacks] = {}
+        self._sweep_at = time.time() + ttl / 16
+        self.replaced = 0
+        self.expired = 0
+        self.evicted = 0
+        self.collected = 0
+
+    @staticmethod
+    def _span(keys: List[str], prefix: str) -> Tuple[int, int]:
+        start = bisect.bisect_left(keys, prefix)
+        if not prefix:
+            return start, len(keys)
+        # The smallest string greater than every string starting with prefix
+        end = bisect.bisect_left(keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo=start)
+        return start, end
+
+    # The helpers below expect the lock to be held
+
+    def _discard(self, user: _UserCallbacks, key: str) -> None:
+        """Removes key from the entries and the sorted keys, not from its generation."""
+        del user.entries[key]
+        del user.keys[bisect.bisect_left(user.keys, key)]
+
+    def _unlink(self, user: _UserCallbacks, key: str, entry: _Entry) -> None:
+        """Removes key from the generation of its scope, and the scope once it has no keys left."""
+        scope = user.scopes.get(entry.scope) if entry.generation is not None else None
+        if scope is None:
+            return
+        keys = scope.keys.get(entry.generation)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del scope.keys[entry.generation]
+            if not scope.keys:
+                del user.scopes[entry.scope]
+
+    def _remove(self, user: _UserCallbacks, key: str) -> None:
+        entry = user.entries[key]
+        self._discard(user, key)
+        self._unlink(user, key, entry)
+
+    def _advance(self, user: _UserCallbacks, scope_id: Hashable, marker: Optional[Hashable]) -> int:
+        """Returns the generation of the scope for marker, dropping the generations it replaces."""
+        scope = user.scopes.get(scope_id)
+        if scope is None:
+            scope = user.scopes[scope_id] = _Scope(marker)
+        elif marker is not None and marker != scope.marker:
+            scope.marker = marker
+            scope.generation += 1
+            for generation in [g for g in scope.keys if g <= scope.generation - self.keep_generations]:
+                for key in scope.keys.pop(generation):
+                    self._discard(user, key)
+                    self.replaced += 1
+        scope.keys.setdefault(scope.generation, set())
+        return scope.generation
+
+    def _expire(self, user: _UserCallbacks, now: float) -> None:
+        while user.entries:
+            key, entry = next(iter(user.entries.items()))
+            if entry.used_at + self.ttl > now:
+                break
+            self._remove(user, key)
+            self.expired += 1
+
+    def _sweep(self, now: float) -> None:
+        """Expires callbacks of every user, at most every ttl / 16 seconds, so idle users are reclaimed too."""
+        if now < self._sweep_at:
+            return
+        self._sweep_at = now + self.ttl / 16
+        for user_id in list(self._users):
+            user = self._users[user_id]
+            self._expire(user, now)
+            if not user.entries:
+                del self._users[user_id]
+
+    def _live(self, user: _UserCallbacks, key: str, now: float) -> Optional[Callable]:
+        """Returns the callback of key and marks it used, removes it if it expired or was collected."""
+        entry = user.entries[key]
+        callback = entry.resolve()
+        if callback is None or entry.used_at + self.ttl <= now:
+            self._remove(user, key)
+            if callback is None:
+                self.collected += 1
+            else:
+                self.expired += 1
+            return None
+        entry.used_at = now
+        user.entries.move_to_end(key)
+        return callback
+
+    def _drop_if_empty(self, user_id: Hashable, user: _UserCallbacks) -> None:
+        if not user.entries:
+            del self._users[user_id]
+
+    def register(self, user_id: Hashable, key: str, callback: Callable, scope: Hashable = None,
+                 generation: Optional[Hashable] = None, weak: bool = False) -> None:
+        """
+        Registers callback for key, replacing a previous registration of the key.
+
+        Args:
+            scope (Hashable): Owner of the registration, usually the Streamlit session id.
+            generation (Optional[Hashable]): Marker of the run registering, usually the script run. When it
+                differs from the previous marker of the scope, older generations of the scope are dropped.
+                None keeps the current generation, e.g. for fragment reruns.
+            weak (bool): Keep only a weak reference, to a bound method's instance for methods. Falls back to
+                a strong reference for callables that can not be weakly referenced.
+        """
+        if weak:
+            try:
+                callback = weakref.WeakMethod(callback) if inspect.ismethod(callback) else weakref.ref(callback)
+            except TypeError:
+                weak = False
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            user = self._users.get(user_id)
+            if user is None:
+                user = self._users[user_id] = _UserCallbacks()
+            self._expire(user, now)
+            previous = user.entries.get(key)
+            if previous is None:
+                bisect.insort(user.keys, key)
+            else:
+                self._unlink(user, key, previous)
+                user.entries.move_to_end(key)
+            number = self._advance(user, scope, generation) if scope is not None else None
+            user.entries[key] = _Entry(callback, weak, now, scope, number)
+            if number is not None:
+                user.scopes[scope].keys[number].add(key)
+            while len(user.entries) > self.max_per_user:
+                self._remove(user, next(iter(user.entries)))
+                self.evicted += 1
+
+    def get(self, user_id: Hashable, key: str) -> Optional[Tuple[Callable, float]]:
+        """Returns (callback, registered_at) of key, None if it is not registered."""
+        now = time.time()
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or key not in user.entries:
+                return None
+            callback = self._live(user, key, now)
+            if callback is None:
+                self._drop_if_empty(user_id, user)
+                return None
+            return callback, user.entries[key].registered_at
+
+    def with_prefix(self, user_id: Hashable, prefix: str) -> List[Tuple[str, Callable, float]]:
+        """Returns (key, callback, registered_at) of every key of the user starting with prefix."""
+        now = time.time()
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return []
+            start, end = self._span(user.keys, prefix)
+            found = []
+            for key in user.keys[start:end]:
+                callback = self._live(user, key, now)
+                if callback is not None:
+                    found.append((key, callback, user.entries[key].registered_at))
+            self._drop_if_empty(user_id, user)
+            return found
+
+    def remove_prefix(self, user_id: Hashable, prefix: str) -> List[str]:
+        """Removes every key of the user starting with prefix and returns the removed keys."""
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return []
+            start, end = self._span(user.keys, prefix)
+            removed = user.keys[start:end]
+            del user.keys[start:end]
+            for key in removed:
+                self._unlink(user, key, user.entries.pop(key))
+            self._drop_if_empty(user_id, user)
+            return removed
+
+    def remove(self, user_id: Hashable, key: str) -> bool:
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or key not in user.entries:
+                return False
+            self._remove(user, key)
+            self._drop_if_empty(user_id, user)
+            return True
+
+    def __contains__(self, user_id: Hashable) -> bool:
+        with self._lock:
+            return user_id in self._users
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(user.entries) for user in self._users.values())
+
+    def counts(self) -> Dict[Hashable, int]:
+        """Number of callbacks per user."""
+        with self._lock:
+            return {user_id: len(user.entries) for user_id, user in self._users.items()}
+
+    def memory_report(self) -> dict:
+        """
+        Returns the callbacks held per user and an estimate of the memory they retain.
+
+        retained_bytes sums everything reachable from the closures, defaults, bound instances and partial
+        arguments of the strongly held callbacks, counting objects shared by callbacks of a user once.
+        Sizes are computed outside the lock, so the report may be slow for callbacks holding large frames
+        without blocking the server.
+        """
+        with self._lock:
+            held = {user_id: [(entry.resolve(), entry.weak, entry.scope) for entry in user.entries.values()]
+                    for user_id, user in self._users.items()}
+            totals = {'replaced': self.replaced, 'expired': self.expired, 'evicted': self.evicted,
+                      'collected': self.collected}
+        users = {}
+        for user_id, entries in held.items():
+            seen = set()
+            users[user_id] = {
+                'callbacks': len(entries),
+                'weak': sum(1 for _, weak, _ in entries if weak),
+                'sessions': len({scope for _, _, scope in entries if scope is not None}),
+                'retained_bytes': sum(retained_size(callback, seen) for callback, weak, _ in entries
+                                      if callback is not None and not weak),
+            }
+        totals['callbacks'] = sum(user['callbacks'] for user in users.values())
+        totals['retained_bytes'] = sum(user['retained_bytes'] for user in users.values())
+        return {'users': users, 'totals': totals}
+
+
+def _callback_roots(callback: Any) -> List[Any]:
+    """Objects a callable keeps alive beyond its code and globals."""
+    if isinstance(callback, functools.partial):
+        return [callback.func, callback.args, callback.keywords]
+    if inspect.ismethod(callback):
+        return [callback.__self__, callback.__func__]
+    roots = []
+    if isinstance(callback, types.FunctionType):
+        roots.extend(cell.cell_contents for cell in callback.__closure__ or () if _cell_filled(cell))
+        roots.extend((callback.__defaults__, callback.__kwdefaults__))
+    wrapped = getattr(callback, '__wrapped__', None)
+    if wrapped is not None:
+        roots.append(wrapped)
+    if not isinstance(callback, types.FunctionType) and hasattr(callback, '__dict__'):
+        roots.append(callback)
+    return roots
+
+
+def _cell_filled(cell) -> bool:
+    try:
+        cell.cell_contents
+        return True
+    except ValueError:
+        return False
+
+
+def _object_size(obj: Any, seen: Set[int], depth: int) -> int:
+    if obj is None or id(obj) in seen or isinstance(obj, (type, types.ModuleType)):
+        return 0
+    seen.add(id(obj))
+    memory_usage = getattr(obj, 'memory_usage', None)
+    if callable(memory_usage) and hasattr(obj, 'dtypes'):  # pandas frames and series
+        usage = memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    nbytes = getattr(obj, 'nbytes', None)
+    if isinstance(nbytes, int):  # numpy arrays
+        return sys.getsizeof(obj) + (0 if getattr(obj, 'base', None) is not None else nbytes)
+    size = sys.getsizeof(obj)
+    if depth <= 0:
+        return size
+    if isinstance(obj, (types.FunctionType, types.MethodType, functools.partial)):
+        return size + sum(_object_size(root, seen, depth - 1) for root in _callback_roots(obj))
+    if isinstance(obj, dict):
+        return size + sum(_object_size(k, seen, depth - 1) + _object_size(v, seen, depth - 1)
+                          for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        return size + sum(_object_size(item, seen, depth - 1) for item in obj)
+    attributes = getattr(obj, '__dict__', None)
+    if isinstance(attributes, dict):
+        size += _object_size(attributes, seen, depth - 1)
+    return size
+
+
+def retained_size(callback: Callable, seen: Optional[Set[int]] = None, depth: int = 8) -> int:
+    """
+    Estimates the bytes a callback keeps alive through its closure, defaults, instance and partial arguments.
+
+    Objects whose ids are in seen are skipped and the ids visited are added, so callers can count shared
+    objects once. Modules, classes and function globals are not counted.
+    """
+    seen = set() if seen is None else seen
+    return sum(_object_size(root, seen, depth) for root in _callback_roots(callback))
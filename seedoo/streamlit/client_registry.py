@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+
+class ClientReadinessRegistry:
+    """
+    Keeps one readiness future per client path so senders can wait for a component to connect.
+
+    A future is resolved with the websocket when the component sends its first message and
+    is replaced when that socket goes away, so waiters wake the moment a client is ready
+    instead of polling `clients`. Each waiter registers its own loop future and removes it
+    again when it times out, and a pending path nobody waits for is dropped.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._waiters = {}  # path -> set of asyncio futures of the senders waiting on it
+
+    def _future_for(self, path):
+        with self._lock:
+            return self._future_for_locked(path)
+
+    def _future_for_locked(self, path):
+        future = self._futures.get(path)
+        if future is None:
+            future = Future()
+            self._futures[path] = future
+        return future
+
+    def mark_ready(self, path, websocket):
+        future = self._future_for(path)
+        if future.done() and future.result() is not websocket:
+            # A new socket took over the path before the old one was discarded.
+            with self._lock:
+                future = Future()
+                self._futures[path] = future
+        try:
+            future.set_result(websocket)
+        except InvalidStateError:
+            pass
+        with self._lock:
+            waiters = self._waiters.pop(path, ())
+        for waiter in waiters:
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter, future.result())
+
+    def discard(self, path, websocket=None):
+        with self._lock:
+            future = self._futures.get(path)
+            if future is None or not future.done():
+                return
+            if websocket is None or future.result() is websocket:
+                self._futures.pop(path)
+
+    def ready_client(self, path):
+        with self._lock:
+            future = self._futures.get(path)
+        if future is not None and future.done():
+            return future.result()
+        return None
+
+    async def wait(self, path, timeout):
+        waiter = asyncio.get_running_loop().create_future()
+        with self._lock:
+            future = self._future_for_locked(path)
+            if future.done():
+                return future.result()
+            self._waiters.setdefault(path, set()).add(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(path)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[path]
+                        if not future.done() and self._futures.get(path) is future:
+                            del self._futures[path]
+
+
+def _resolve(waiter, websocket):
+    if not waiter.done():
+        waiter.set_result(websocket)
@@ -1,33 +1,90 @@
 import asyncio
+import contextvars
+import hashlib
 import logging
 import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
 import websockets
 import websockets.exceptions
 import threading
-import msgpack
 import json
 from seedoo.streamlit.tracking_executor import TrackingThreadPoolExecutor, safe_name
+from seedoo.streamlit.client_registry import ClientReadinessRegistry
+from seedoo.streamlit.callback_registry import CallbackRegistry
+from seedoo.streamlit.scheduler import FairScheduler, Overloaded, PRIORITY_NORMAL, PRIORITY_UI
+from seedoo.streamlit.single_flight import ResultCache, SingleFlight, request_key
+from seedoo.streamlit import serialization
+from seedoo.streamlit.serialization import CustomJSONEncoder
+from seedoo.streamlit.metrics import MetricsRegistry
 import time
 import os
 import traceback
 import sys
+import http
 from functools import partial
 from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 SEEDOO_SEMAPHORE_NAME = 'seedoo_ux_semaphore'
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
 error_auth_text = 'user not authenticated'
 user_id_default = 'user_id_default'
+# request_id of the component message whose callback runs on this thread, added to the data it pushes
+current_request_id = contextvars.ContextVar('seedoo_request_id', default=None)
 
 
-class CustomJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.astype(int).tolist()
-        return super(CustomJSONEncoder, self).default(obj)
+def fairness_key(websocket=None, access_token=None):
+    """
+    Who a request is scheduled for: the server-validated access token it carries, else the connection it came on.
+
+    The user_id and session_id of a message are chosen by the client, which could rotate them to get a fresh
+    share of the pool, so they are not used. The token is hashed to keep it out of logs.
+    """
+    if access_token is not None:
+        return 'token:' + hashlib.blake2b(str(access_token).encode(), digest_size=8).hexdigest()
+    return f'connection:{id(websocket)}'
+
+
+def with_request_id(data, request_id):
+    """Tags an event with the request_id of the message it answers, if the client sent one."""
+    if request_id is not None:
+        data['request_id'] = request_id
+    return data
+
+
+def overloaded_event(id, exc):
+    """Error event sent back when the scheduler sheds a message, with a hint for when to retry."""
+    return {'id': id, 'event': 'message',
+            'data': {'message': str(exc), 'type': 'error', 'code': 'overloaded',
+                     'retry_after_ms': round(exc.retry_after_ms)}}
+
+
+def _for_request(request_id, callback):
+    """Binds callback to a request_id, named after the callback so executor metrics keep it apart."""
+
+    def call(message):
+        token = current_request_id.set(request_id)
+        try:
+            return callback(message)
+        finally:
+            current_request_id.reset(token)
+
+    call.__name__ = safe_name(callback)
+    return call
+
+
+def script_run_generation():
+    """Returns (session id, marker of the current script run), (None, None) outside of a script run."""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None, None
+    if getattr(ctx, 'fragment_ids_this_run', None):
+        # A fragment rerun leaves the rest of the page, and the callbacks it registered, in place
+        return ctx.session_id, None
+    # reset() replaces this set at the start of every run, so its id differs from the previous run's
+    run_widgets = getattr(ctx, 'widget_ids_this_run', None)
+    return ctx.session_id, id(run_widgets) if run_widgets is not None else None
 
 
 class WebSocketServer:
@@ -41,17 +98,36 @@ class WebSocketServer:
             host = os.environ.get('SEEDOO_WEBSOCKET_EVENT_HOST', 'localhost')
             if forwarded_port:
                 port = int(forwarded_port)
-
-            WebSocketServer._instance = WebSocketServer(host, port=port, ctx=st)
+            batch_window_ms = float(os.environ.get('SEEDOO_WEBSOCKET_BATCH_WINDOW_MS', '0'))
+            metrics_endpoint = os.environ.get('SEEDOO_WEBSOCKET_METRICS', '') not in ('', '0', 'false')
+            callbacks_per_user = int(os.environ.get('SEEDOO_CALLBACKS_PER_USER', '10000'))
+            callback_ttl = float(os.environ.get('SEEDOO_CALLBACK_TTL', '86400'))
+            user_concurrency = int(os.environ.get('SEEDOO_USER_CONCURRENCY', '8'))
+            function_concurrency = int(os.environ.get('SEEDOO_FUNCTION_CONCURRENCY', '32'))
+            user_queue = int(os.environ.get('SEEDOO_USER_QUEUE', '100'))
+            pipeline_window = int(os.environ.get('SEEDOO_PIPELINE_WINDOW', '1'))
+
+            WebSocketServer._instance = WebSocketServer(host, port=port, ctx=st,
+                                                        batch_window=batch_window_ms / 1000,
+                                                        metrics_endpoint=metrics_endpoint,
+                                                        callbacks_per_user=callbacks_per_user,
+                                                        callback_ttl=callback_ttl,
+                                                        user_concurrency=user_concurrency,
+                                                        function_concurrency=function_concurrency,
+                                                        user_queue=user_queue,
+                                                        pipeline_window=pipeline_window)
             WebSocketServer._instance.start_server()
 
         return WebSocketServer._instance
 
-    def __init__(self, host="localhost", port=9897, ctx=None):
+    def __init__(self, host="localhost", port=9897, ctx=None, batch_window=0, batch_max_bytes=256 * 1024,
+                 metrics_endpoint=False, callbacks_per_user=10000, callback_ttl=86400, user_concurrency=8,
+                 function_concurrency=32, user_queue=100, pipeline_window=1):
         self.host = host
         self.logger = logging.getLogger(__name__)
         self.port = port
-        self.callbacks = {}
+        # Component callbacks by user and key, replaced on reruns and bounded per user
+        self.callbacks = CallbackRegistry(max_per_user=callbacks_per_user, ttl=callback_ttl)
         self.timeout = 130
         self.paths = {}
         self.is_running = False
@@ -59,7 +135,20 @@ class WebSocketServer:
         self.tokens_store = None
         self.running_server = None
         num_cpus = multiprocessing.cpu_count()
-        self.thread_pool_executor = TrackingThreadPoolExecutor(max_workers=80, timeout=180)
+        self.metrics = MetricsRegistry()
+        self.metrics_endpoint = metrics_endpoint  # Serve Prometheus text on GET /metrics of the websocket port
+        self.thread_pool_executor = TrackingThreadPoolExecutor(max_workers=80, timeout=180, metrics=self.metrics)
+        self.process_pool_workers = num_cpus
+        self.process_pool_executor = None  # Started on the first process-bound register_function
+        self.process_functions = set()
+        self.function_priorities = {}
+        self.shared_functions = {}  # function name -> result cache TTL in seconds, 0 only shares concurrent calls
+        self.single_flight = SingleFlight()
+        self.function_cache = ResultCache()
+        # Orders callbacks and functions per user before they reach the pools, see FairScheduler
+        self.scheduler = FairScheduler(max_concurrency=self.thread_pool_executor._max_workers,
+                                       per_user=user_concurrency, per_function=function_concurrency,
+                                       max_queue_per_user=user_queue, metrics=self.metrics)
 
         def empty():
             return
@@ -68,6 +157,15 @@ class WebSocketServer:
             self.thread_pool_executor.submit(empty)
 
         self.clients = {}  # Keep track of connected clients
+        self.readiness = ClientReadinessRegistry()  # Wakes senders once a client sent its first message
+        self.outboxes = {}  # Per-client outbound queues, only touched on the server loop
+        self.writers = {}  # Per-client writer tasks draining the outboxes
+        self.batch_window = batch_window  # Seconds to collect pushes per client, 0 sends each message at once
+        self.batch_max_bytes = batch_max_bytes  # Upper bound for a single batched frame
+        # Callbacks in flight per component connection, 1 runs them one at a time in arrival order
+        self.pipeline_window = max(1, pipeline_window)
+        # Created up front so send_data can hand messages over before the server thread starts.
+        self.loop = asyncio.new_event_loop()
 
         if ctx is not None:
             for thread in threading.enumerate():
@@ -82,6 +180,7 @@ class WebSocketServer:
                 self.logger.warning(f'Path {path} is already in clients!')
             self.clients[path] = websocket
             websocket.is_component_ready = False
+            websocket.push_encoding = serialization.ENCODING_JSON
             route = ''
 
             if path.startswith('/ws/functions') or path.startswith('/wss/functions'):
@@ -127,34 +226,58 @@ class WebSocketServer:
             except Exception as exc:
                 self.logger.exception(f'Error in socket handler: {exc}')
 
-    async def error(self, websocket, error_auth_text):
+    async def error(self, websocket, error_auth_text, request_id=None):
         self.logger.warning(f'{error_auth_text}')
-        await asyncio.wait_for(
-            websocket.send(json.dumps({'event': 'message', 'data': {'message': error_auth_text, 'type': 'error'}})),
-            timeout=self.timeout)
+        error_message_data = with_request_id(
+            {'event': 'message', 'data': {'message': error_auth_text, 'type': 'error'}}, request_id)
+        await asyncio.wait_for(websocket.send(json.dumps(error_message_data)), timeout=self.timeout)
 
     async def execute_target_function(self, websocket, target_function, message, path):
         target_function_name = safe_name(target_function)
         id = 'default_this_means_did not load from message'
+        request_id = None
         try:
             self.logger.info(f'Executing function: {target_function_name}')
             start = time.time()
             message_data = json.loads(message)
+            request_id = message_data.get('request_id')
+            if request_id is not None:
+                id = request_id
             if 'session_id' in message_data:
                 message_data['session_state'] = self.tokens_store.get_session_state(message_data['session_id'])
             if 'user_id' in message_data:
                 message_data['user_state'] = self.tokens_store.get_user_state(message_data['user_id'])
             duration = (time.time() - start) * 1000
+            self.metrics.observe('json_decode_ms', duration, function=target_function_name)
             (self.logger.warning if duration > 50 else self.logger.debug)(f'message data json load: {duration} ms')
 
             start = time.time()
 
             try:
                 async def start_function():
-                    response = await asyncio.get_running_loop().run_in_executor(self.thread_pool_executor,
-                                                                                target_function, message_data)
-                    await asyncio.wait_for(self.send_response(websocket, message_data, response),
-                                           timeout=self.timeout)
+                    loop = asyncio.get_running_loop()
+                    user = self._fairness_key(message_data, websocket)
+                    priority = self.function_priorities.get(target_function_name, PRIORITY_NORMAL)
+
+                    async def compute():
+                        if target_function_name in self.process_functions:
+                            # Runs and encodes in a worker process, only the encoded payload comes back
+                            return await self.scheduler.run(user, target_function_name, lambda: loop.run_in_executor(
+                                self.process_pool_executor, serialization.call_and_encode, target_function,
+                                message_data), priority)
+                        response = await self.scheduler.run(user, target_function_name, lambda: loop.run_in_executor(
+                            self.thread_pool_executor, target_function, message_data), priority)
+                        return await self._encode_response(message_data, response, target_function_name)
+
+                    try:
+                        payload = await self._shared_call(target_function_name, message_data, compute)
+                    except Overloaded as exc:
+                        await self.send_response(websocket, {}, with_request_id(overloaded_event(id, exc), request_id))
+                        return
+                    if request_id is not None:
+                        payload = serialization.wrap_response(payload, request_id, message_data.get('binary'))
+                    with self.metrics.timer('send_ms', function=target_function_name):
+                        await asyncio.wait_for(websocket.send(payload), timeout=self.timeout)
 
                 if self.tokens_store:
                     if 'accessToken' in message_data:
@@ -162,9 +285,9 @@ class WebSocketServer:
                         if self.tokens_store.check_valid(accessToken):
                             await start_function()
                         else:
-                            await self.error(websocket, error_auth_text)
+                            await self.error(websocket, error_auth_text, request_id)
                     else:
-                        await self.error(websocket, 'no accessToken')
+                        await self.error(websocket, 'no accessToken', request_id)
                 else:
                     await start_function()
             except asyncio.TimeoutError:
@@ -175,6 +298,7 @@ class WebSocketServer:
                         self.clients.pop(path)
 
             duration = (time.time() - start) * 1000
+            self.metrics.observe('function_ms', duration, function=target_function_name)
             (self.logger.warning if duration > 500 else self.logger.debug)(
                 f'function {target_function_name} executed for {duration} ms')
 
@@ -196,7 +320,8 @@ class WebSocketServer:
 
                 message = f"{exc_value} (FN: {function_name}, LN:{line_number})"
 
-                error_message_data = {'id': id, 'event': 'message', 'data': {'message': message, 'type': 'error'}}
+                error_message_data = with_request_id(
+                    {'id': id, 'event': 'message', 'data': {'message': message, 'type': 'error'}}, request_id)
                 try:
                     await asyncio.wait_for(self.send_response(websocket, {}, error_message_data), timeout=10)
                 except asyncio.TimeoutError:
@@ -209,36 +334,112 @@ class WebSocketServer:
                 self.logger.critical('Error in handling exception!!!')
                 self.logger.exception('CRITICAL!! Error in handling exception!!!')
 
-    async def send_response(self, websocket, message_data, response):
+    async def _encode_response(self, message_data, response, target_function_name=''):
         if message_data.get('binary'):
             self.logger.info('Sending binary response')
-            binary_data = msgpack.packb(response, use_bin_type=True)
-            await websocket.send(binary_data)
-        else:
-            self.logger.info('Sending text json response')
-            start = time.time()
-            text_response = await asyncio.get_running_loop().run_in_executor(self.thread_pool_executor, json.dumps,
-                                                                             response)
-            json_delay = (time.time() - start) * 1000
-            (self.logger.debug if json_delay < 20 else self.logger.warning)(
-                f'_send_data_async json dumps took delay is {json_delay} ms')
-
-            await websocket.send(text_response)
+            with self.metrics.timer('encode_ms', function=target_function_name):
+                return serialization.encode_response(response, binary=True)
+        self.logger.info('Sending text json response')
+        start = time.time()
+        payload = await asyncio.get_running_loop().run_in_executor(self.thread_pool_executor,
+                                                                   serialization.encode_response, response)
+        json_delay = (time.time() - start) * 1000
+        self.metrics.observe('encode_ms', json_delay, function=target_function_name)
+        (self.logger.debug if json_delay < 20 else self.logger.warning)(
+            f'_send_data_async json dumps took delay is {json_delay} ms')
+        return payload
+
+    async def send_response(self, websocket, message_data, response, target_function_name=''):
+        payload = await self._encode_response(message_data, response, target_function_name)
+        with self.metrics.timer('send_ms', function=target_function_name):
+            await websocket.send(payload)
+
+    async def _shared_call(self, function_name, message_data, compute):
+        """
+        Returns the encoded response of compute().
+
+        For functions registered with single_flight or cache_ttl, identical concurrent calls share one
+        execution, and with cache_ttl the payload is served from the cache until it expires. Calls are
+        identical when their messages match apart from request ids, tokens and encoding flags, for the
+        same session, user and state versions.
+        """
+        cache_ttl = self.shared_functions.get(function_name)
+        if cache_ttl is None:
+            return await compute()
+        key = request_key(function_name, message_data)
+        if cache_ttl:
+            payload = self.function_cache.get(key)
+            if payload is not None:
+                return payload
+
+        async def compute_and_cache():
+            payload = await compute()
+            if cache_ttl:
+                self.function_cache.put(key, payload, cache_ttl)
+            return payload
+
+        return await self.single_flight.do(key, compute_and_cache)
 
     def removeByKeyFragment(self, full_key, user_id=user_id_default):
-        if user_id not in self.callbacks:
-            return
-
         keyFragment = "/".join(full_key.split("/")[2:])
-        keysToDelete = [key for key in self.callbacks[user_id] if keyFragment in key]
-
-        for key in keysToDelete:
-            self.callbacks[user_id].pop(key, None)
+        for key in self.callbacks.remove_prefix(user_id, keyFragment):
             self.logger.info(f'Clean callback with key: {key}')
+
+    def _fairness_key(self, message, websocket):
+        # Only called once check_valid accepted the message's accessToken, when there is a tokens store
+        return fairness_key(websocket, message.get('accessToken') if self.tokens_store else None)
+
+    async def _run_callback(self, key, callback, message, websocket=None):
+        loop = asyncio.get_running_loop()
+        request_id = message.get('request_id')
+        try:
+            with self.metrics.timer('callback_ms', key=key):
+                await self.scheduler.run(self._fairness_key(message, websocket), key, lambda: loop.run_in_executor(
+                    self.thread_pool_executor, _for_request(request_id, callback), message), PRIORITY_UI)
+        except Overloaded as exc:
+            self.send_data(with_request_id(overloaded_event(key, exc), request_id))
+            return
+        except Exception as exc:
+            self.logger.exception(f'Error in callback for key: {key}')
+            if request_id is not None:
+                self.send_data({'id': key, 'event': 'message', 'request_id': request_id,
+                                'data': {'message': str(exc), 'type': 'error'}})
+            return
+        if request_id is not None:
+            # Lets the client settle the request, the data the callback pushed was sent before this
+            self.send_data({'id': key, 'event': 'callback_done', 'request_id': request_id})
+
+    async def _pipeline_callback(self, key, callback, message, websocket, window, chains):
+        """
+        Runs a callback without blocking the receive loop, at most pipeline_window per connection.
+
+        Callbacks sharing an order key run in arrival order, the order key is the message's 'order_key'
+        and defaults to the component key. A null 'order_key' does not wait for any other callback.
+        """
+        await window.acquire()
+        order_key = message.get('order_key', key)
+        previous = chains.get(order_key) if order_key is not None else None
+
+        async def run():
+            try:
+                if previous is not None:
+                    await asyncio.wait([previous])
+                await self._run_callback(key, callback, message, websocket)
+            finally:
+                window.release()
+                if order_key is not None and chains.get(order_key) is task:
+                    del chains[order_key]
+
+        task = asyncio.create_task(run())
+        if order_key is not None:
+            chains[order_key] = task
+
     async def handle_other_paths(self, websocket, path):
         timeouts = 0
         key = None
         user_key = None
+        window = asyncio.Semaphore(self.pipeline_window)
+        chains = {}  # order key -> task of the last callback with that key
         try:
             while True:
                 try:
@@ -261,40 +462,56 @@ class WebSocketServer:
 
                     if not user_key:
                         user_key = user_id_default
+                    self.metrics.observe('json_decode_ms', json_delay, key=key)
                     (self.logger.info if delay < 20 else self.logger.warning)(
                         f"Socket await for key {key} recv_delay {delay} ms, json_delay: {json_delay} ms")
 
+                    if message.get('encoding') in serialization.ENCODINGS:
+                        websocket.push_encoding = message['encoding']
                     websocket.is_component_ready = True
+                    self.readiness.mark_ready(path, websocket)
                     self.logger.info(f'Got callback with key: {key}')
 
                     def send_login_error(id):
-                        self.send_data(
-                            {'id': id, 'event': 'message', 'data': {'message': error_auth_text, 'type': 'error'}})
-
-                    if user_key in self.callbacks:
-                        if key in self.callbacks[user_key]:
-                            if self.tokens_store:
-                                if 'accessToken' in message:
-                                    accessToken = message['accessToken']
-                                    if self.tokens_store.check_valid(accessToken):
-                                        callback, submit_time = self.callbacks[user_key][key]
-                                        delay = (time.time() - submit_time) * 1000
-                                        (self.logger.info if delay < 20 else self.logger.warning)(
-                                            f'Calling key: {key},user: {user_key}, for {callback}, delay: {delay}')
-                                        await asyncio.get_running_loop().run_in_executor(self.thread_pool_executor,
-                                                                                         callback, message)
-                                    else:
-                                        send_login_error(key)
+                        self.send_data(with_request_id(
+                            {'id': id, 'event': 'message', 'data': {'message': error_auth_text, 'type': 'error'}},
+                            message.get('request_id')))
+
+                    async def call(callback):
+                        if self.pipeline_window > 1:
+                            await self._pipeline_callback(key, callback, message, websocket, window, chains)
+                        else:
+                            await self._run_callback(key, callback, message, websocket)
+
+                    registered = self.callbacks.get(user_key, key)
+                    if registered is not None:
+                        if self.tokens_store:
+                            if 'accessToken' in message:
+                                accessToken = message['accessToken']
+                                if self.tokens_store.check_valid(accessToken):
+                                    callback, submit_time = registered
+                                    delay = (time.time() - submit_time) * 1000
+                                    (self.logger.info if delay < 20 else self.logger.warning)(
+                                        f'Calling key: {key},user: {user_key}, for {callback}, delay: {delay}')
+                                    await call(callback)
                                 else:
                                     send_login_error(key)
                             else:
-                                callback, submit_time = self.callbacks[user_key][key]
-                                delay = (time.time() - submit_time) * 1000
-                                (self.logger.info if delay < 20 else self.logger.warning)(
-                                    f'Calling key: {key}, for {callback}, delay: {delay}')
-                                await asyncio.get_running_loop().run_in_executor(self.thread_pool_executor,
-                                                                                 callback, message)
-
+                                send_login_error(key)
+                        else:
+                            callback, submit_time = registered
+                            delay = (time.time() - submit_time) * 1000
+                            (self.logger.info if delay < 20 else self.logger.warning)(
+                                f'Calling key: {key}, for {callback}, delay: {delay}')
+                            await call(callback)
+                    else:
+                        self.logger.warning(f'No callback registered for key: {key}, user: {user_key}')
+                        if message.get('request_id') is not None:
+                            # Settles the client's request instead of leaving it waiting for its timeout
+                            self.send_data(with_request_id(
+                                {'id': key, 'event': 'message', 'data': {'message': f'No callback for {key}',
+                                                                         'type': 'error', 'code': 'unknown_callback'}},
+                                message['request_id']))
 
                 except (websockets.exceptions.ConnectionClosedOK, websockets.exceptions.ConnectionClosedError):
                     self.logger.warning('Error in communicating with socket')
@@ -307,6 +524,7 @@ class WebSocketServer:
                 except Exception as exc:
                     self.logger.exception(f'Error in socket handler: {exc}')
         finally:
+            self.readiness.discard(path, websocket)
             if path is not None and path in self.clients:
                 self.logger.info(f'Popping from clients: {path}')
                 self.clients.pop(path)
@@ -314,62 +532,178 @@ class WebSocketServer:
                     self.removeByKeyFragment(path,user_key)
 
     async def client_for_key(self, key, timeout):
-        start_time = time.time()
-        while True:
-            client = self.clients.get(key, None)
-            if client is not None and client.is_component_ready:
-                return client
-            elif time.time() - start_time > timeout:
-                break
-            await asyncio.sleep(0.1)  # Sleep for a small interval to avoid busy-waiting
-        return None
+        return await self.readiness.wait(key, timeout)
 
-    def _send_data_async(self, data, calltime):
-        try:
-            call_delay = (time.time() - calltime) * 1000
+    def _path_for_data(self, data):
+        if os.name == 'nt':
+            return f"/ws/{data['id']}"
+        return os.path.join("/ws", data['id'])
 
-            (self.logger.debug if call_delay < 2 else self.logger.warning)(
-                f'_send_data_async call delay is {call_delay} ms')
-            start = time.time()
-            data_as_json_string = json.dumps(data, cls=CustomJSONEncoder)
-            json_delay = (time.time() - start) * 1000
-            (self.logger.debug if json_delay < 2 else self.logger.warning)(
-                f'_send_data_async json dumps took delay is {json_delay} ms')
+    def _enqueue_data(self, data, calltime):
+        # Runs on the server loop, so outboxes and writers need no locking.
+        try:
+            key = self._path_for_data(data)
+        except Exception as exc:
+            self.logger.exception('Error in resolving client for data')
+            return
 
-            if os.name == 'nt':
-                key = f"/ws/{data['id']}"
+        queue = self.outboxes.get(key)
+        if queue is None:
+            queue = asyncio.Queue()
+            self.outboxes[key] = queue
+        queue.put_nowait((data, calltime))
+        if key not in self.writers:
+            self.writers[key] = self.loop.create_task(self._client_writer(key, queue))
+
+    def _coalesce(self, items):
+        # Later updates to the same (id, event, request_id) supersede earlier ones still waiting in the window.
+        # callback_done and errors settle requests on the client, so every one of them is sent.
+        latest = {}
+        for index, (data, calltime) in enumerate(items):
+            event = data.get('event')
+            body = data.get('data')
+            if event == 'callback_done' or (isinstance(body, dict) and body.get('type') == 'error'):
+                coalesce_key = index
             else:
-                key = os.path.join("/ws", data['id'])
+                coalesce_key = (data.get('id'), event, data.get('request_id'))
+            latest.pop(coalesce_key, None)
+            latest[coalesce_key] = (data, calltime)
+        return list(latest.values())
+
+    def _encode_items(self, key, items, encoding, start):
+        payloads = []
+        for data, calltime in items:
+            call_delay = (start - calltime) * 1000
+            self.metrics.observe('push_delay_ms', call_delay, key=key)
+            (self.logger.debug if call_delay < 2 else self.logger.warning)(
+                f'_client_writer call delay is {call_delay} ms')
+            try:
+                payloads.append(serialization.encode(data, encoding))
+            except Exception:
+                # Drops only this message, the rest of the batch is still sent
+                self.logger.exception(f'Error in encoding message for key: {key}')
+        return payloads
+
+    def _frame_batch(self, payloads, encoding):
+        frames = []
+        current = []
+        current_size = 0
+        for payload in payloads:
+            if current and current_size + len(payload) > self.batch_max_bytes:
+                frames.append(current)
+                current = []
+                current_size = 0
+            current.append(payload)
+            current_size += len(payload) + 1
+        if current:
+            frames.append(current)
+        return [frame[0] if len(frame) == 1 else serialization.frame_batch(frame, encoding) for frame in frames]
+
+    async def _client_writer(self, key, queue):
+        try:
+            while not queue.empty():
+                start = time.time()
+                client = await self.client_for_key(key, self.timeout)
+                client_for_key_delay = (time.time() - start) * 1000
+                self.metrics.observe('client_wait_ms', client_for_key_delay, key=key)
+                (self.logger.debug if client_for_key_delay < 0.5 else self.logger.warning)(
+                    f'_client_writer client_for_key took delay is {client_for_key_delay} ms')
+
+                if client is None or not client.open:
+                    dropped = queue.qsize()
+                    while not queue.empty():
+                        queue.get_nowait()
+                    if client is None:
+                        self.logger.warning(f'No client for key: {key}, dropped {dropped} messages')
+                    else:
+                        self.logger.warning(f'Client for key: {key} is no longer open, dropped {dropped} messages')
+                    continue
 
-            start = time.time()
-            client = asyncio.run(self.client_for_key(key, self.timeout))
-            client_for_key_delay = (time.time() - start) * 1000
-            (self.logger.debug if client_for_key_delay < 0.5 else self.logger.warning)(
-                f'_send_data_async client_for_key took delay is {client_for_key_delay} ms')
+                if self.batch_window:
+                    await asyncio.sleep(self.batch_window)  # Let the rest of the burst arrive
 
-            if client and client.open:
-                start = time.time()
-                asyncio.run(client.send(data_as_json_string))
-                data_as_json_string_delay = (time.time() - start) * 1000
-                (self.logger.info if data_as_json_string_delay < 20 else self.logger.warning)(
-                    f'_send_data_async data_as_json_string_delay took delay is {data_as_json_string_delay} ms, data length: {len(data_as_json_string)}')
+                items = []
+                while not queue.empty():
+                    items.append(queue.get_nowait())
+                if self.batch_window:
+                    received = len(items)
+                    items = self._coalesce(items)
+                    self.logger.debug(f'_client_writer coalesced {received} messages into {len(items)} for {key}')
 
-                # await asyncio.wait_for(, timeout=self.timeout)
-                self.logger.info(f'Sent for {key}')
-            else:
-                if client is None:
-                    self.logger.warn(f'No client for key: {key}')
-                else:
-                    self.logger.warn(f'Client for key: {key} is no longer open')
-        except Exception as exc:
-            self.logger.exception('Error')
+                try:
+                    encoding = client.push_encoding
+                    start = time.time()
+                    # Large payloads such as arrays would hold up every other socket if encoded on the loop
+                    payloads = await asyncio.get_running_loop().run_in_executor(
+                        self.thread_pool_executor, self._encode_items, key, items, encoding, start)
+                    frames = self._frame_batch(payloads, encoding) if self.batch_window else payloads
+                    encode_delay = (time.time() - start) * 1000
+                    self.metrics.observe('encode_ms', encode_delay, key=key)
+                    (self.logger.debug if encode_delay < 2 else self.logger.warning)(
+                        f'_client_writer {encoding} encode took delay is {encode_delay} ms')
+
+                    for frame in frames:
+                        start = time.time()
+                        await asyncio.wait_for(client.send(frame), timeout=self.timeout)
+                        send_delay = (time.time() - start) * 1000
+                        self.metrics.observe('send_ms', send_delay, key=key)
+                        (self.logger.info if send_delay < 20 else self.logger.warning)(
+                            f'_client_writer send took delay is {send_delay} ms, data length: {len(frame)}')
+                    self.logger.info(f'Sent {len(items)} messages in {len(frames)} frames for {key}')
+                except (websockets.exceptions.ConnectionClosedOK, websockets.exceptions.ConnectionClosedError,
+                        asyncio.TimeoutError):
+                    self.logger.warning(f'Error in sending to client for key: {key}')
+                except Exception as exc:
+                    self.logger.exception('Error')
+        finally:
+            self.writers.pop(key, None)
+            if queue.empty() and self.outboxes.get(key) is queue:
+                self.outboxes.pop(key)
 
-    def send_data(self, data):  # Regular method
-        calltime = time.time()
-        self.thread_pool_executor.submit(self._send_data_async, data, calltime)
+    def send_data(self, data, calltime=None):  # Regular method
+        # Thread-safe: hands the message to the server loop, which owns the websockets.
+        if calltime is None:
+            calltime = time.time()
+        request_id = current_request_id.get()
+        if request_id is not None and isinstance(data, dict) and 'request_id' not in data:
+            # Pushed by a callback answering a component message, tag it so the client can match it
+            data = {**data, 'request_id': request_id}
+        self.loop.call_soon_threadsafe(self._enqueue_data, data, calltime)
+
+    def stats(self):
+        """
+        Returns the latency histograms collected by the server and its thread pool, in milliseconds.
+
+        Metrics are broken down per registered function ('function' label) and per callback or
+        component key ('key' label): json_decode_ms, encode_ms, send_ms, client_wait_ms, push_delay_ms,
+        callback_ms, function_ms, scheduler_wait_ms, executor_queue_wait_ms and executor_run_ms.
+        """
+        stats = self.metrics.stats()
+        stats['executor'] = {'max_workers': self.thread_pool_executor._max_workers,
+                             'active_threads': self.thread_pool_executor.active_threads}
+        stats['clients'] = len(self.clients)
+        stats['callbacks'] = len(self.callbacks)
+        stats['scheduler'] = self.scheduler.stats()
+        stats['functions'] = {'executed': self.single_flight.executed, 'shared': self.single_flight.shared,
+                              'in_flight': len(self.single_flight), 'cache': self.function_cache.stats()}
+        return stats
+
+    def memory_report(self):
+        """
+        Returns the registered callbacks per user with an estimate of the bytes their closures retain,
+        and totals of the callbacks replaced on reruns, expired, evicted by the per-user cap and collected.
+        """
+        return self.callbacks.memory_report()
+
+    async def _process_request(self, path, request_headers):
+        if self.metrics_endpoint and path == '/metrics':
+            body = self.metrics.render_prometheus().encode()
+            return http.HTTPStatus.OK, [('Content-Type', 'text/plain; version=0.0.4')], body
+        return None
 
     async def _start_server_async(self):
-        server = await websockets.serve(self.handler, self.host, self.port, ping_interval=5, ping_timeout=self.timeout)
+        server = await websockets.serve(self.handler, self.host, self.port, ping_interval=5, ping_timeout=self.timeout,
+                                        process_request=self._process_request)
         self.running_server = server
         self.logger.info(f"WebSocket server started at wss://{self.host}:{self.port}")
         await server.wait_closed()
@@ -378,10 +712,8 @@ class WebSocketServer:
         self.logger.info("STARTING SERVER!!")
 
         def run():
-            loop = asyncio.new_event_loop()
-            self.loop = loop
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(self._start_server_async())
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start_server_async())
 
         if not self.is_running:
             self.server_thread = threading.Thread(target=run)
@@ -394,7 +726,7 @@ class WebSocketServer:
             def wrapper():
                 try:
                     data = callback_function(*args, **kwargs)
-                    self._send_data_async(data, calltime)
+                    self.send_data(data, calltime)
                 except Exception as exc:
                     self.logger.exception('Error in calling callback')
 
@@ -403,32 +735,81 @@ class WebSocketServer:
     def start_callbacks_by_key(self, key, session_id, user_id=user_id_default):
         try:
             if user_id and user_id in self.callbacks:
-                user_callbacks = self.callbacks[user_id]
                 message = {
                     'user_state': self.tokens_store.get_user_state(user_id),
                     'session_state': self.tokens_store.get_session_state(session_id),
                 }
                 count = 0
-                for callback_key, (callback_function, timestamp) in user_callbacks.items():
-                    if key in callback_key:
-                        self.execute_function_and_send_result(callback_function, message )
-                        count += 1
+                for callback_key, callback_function, timestamp in self.callbacks.with_prefix(user_id, key):
+                    self.execute_function_and_send_result(callback_function, message)
+                    count += 1
                 self.logger.info(f"Total callbacks executed: {count}")
         except Exception as exc:
             self.logger.info(f'Error in calling  start_callbacks_by_key')
 
-    def register_callback(self, id, callback_function, user_id=user_id_default):
+    def register_callback(self, id, callback_function, user_id=user_id_default, weak=False):
+        """
+        Registers the callback of a component, called with each message the component sends.
+
+        Called from a script run, the callback belongs to the run's session: once the session reruns,
+        callbacks its previous runs registered and the new runs did not are dropped.
+
+        Args:
+            weak (bool): Keep only a weak reference, e.g. to a bound method of an object kept in session state.
+        """
         self.logger.info(f'Registered callback: {safe_name(callback_function)}')
         if callback_function is not None:
-            if user_id in self.callbacks:
-                self.callbacks[user_id][id] = (callback_function, time.time())
-            else:
-                self.callbacks[user_id] = {}
-                self.callbacks[user_id][id] = (callback_function, time.time())
+            scope, generation = script_run_generation()
+            self.callbacks.register(user_id, id, callback_function, scope=scope, generation=generation, weak=weak)
 
-    def register_function(self, target_function):
+    def _start_process_pool(self):
+        if self.process_pool_executor is not None:
+            return
+        # forkserver children do not inherit the server and Streamlit threads of this process
+        context = multiprocessing.get_context('spawn' if os.name == 'nt' else 'forkserver')
+        self.process_pool_executor = ProcessPoolExecutor(max_workers=self.process_pool_workers, mp_context=context)
+        # Warm up the workers so the first request does not pay for process start-up
+        for _ in range(self.process_pool_workers):
+            self.process_pool_executor.submit(os.getpid)
+        self.logger.info(f'Started process pool with {self.process_pool_workers} workers')
+
+    def register_function(self, target_function, executor=EXECUTOR_THREAD, priority=PRIORITY_NORMAL,
+                          max_concurrency=None, single_flight=False, cache_ttl=None):
+        """
+        Exposes a function on /ws/functions/<name>.
+
+        Args:
+            target_function (Callable): Called with the decoded message, its return value is sent back.
+            executor (str): 'thread' to run on the shared thread pool, 'process' for CPU-bound functions that
+                should run in a process pool. Process-bound functions must be picklable, module-level functions;
+                they get a copy of the message (including the session and user state looked up here) and their
+                response is encoded in the worker.
+            priority (int): Scheduling priority, PRIORITY_UI for functions a user is actively waiting on,
+                PRIORITY_BACKGROUND for prefetching and other work that may wait.
+            max_concurrency (Optional[int]): Overrides the per-function concurrency cap for this function.
+            single_flight (bool): Identical concurrent calls share one execution. Only for functions without
+                side effects, two identical calls of e.g. a save would run once.
+            cache_ttl (Optional[float]): Also keep responses for this many seconds, implies single_flight.
+        """
         func_name = safe_name(target_function)
-        self.logger.info(f'Registered function: {func_name}')
+        if executor == EXECUTOR_PROCESS:
+            try:
+                pickle.dumps(target_function)
+            except Exception as exc:
+                raise ValueError(f'Function {func_name} can not run in a process pool, it is not picklable: {exc}')
+            self._start_process_pool()
+            self.process_functions.add(func_name)
+        elif executor == EXECUTOR_THREAD:
+            self.process_functions.discard(func_name)
+        else:
+            raise ValueError(f"Unknown executor '{executor}' for function {func_name}, use 'thread' or 'process'")
+        self.logger.info(f'Registered function: {func_name}, executor: {executor}')
+        self.function_priorities[func_name] = priority
+        self.scheduler.set_function_limit(func_name, max_concurrency)
+        if cache_ttl or single_flight:
+            self.shared_functions[func_name] = cache_ttl or 0
+        else:
+            self.shared_functions.pop(func_name, None)
         self.paths[func_name] = target_function
 
     def __del__(self):
@@ -439,6 +820,8 @@ class WebSocketServer:
 
         # Shut down the threatd pool executor
         self.thread_pool_executor.shutdown(wait=True)
+        if self.process_pool_executor is not None:
+            self.process_pool_executor.shutdown(wait=True)
 
         if self.running_server:
             self.running_server.close()
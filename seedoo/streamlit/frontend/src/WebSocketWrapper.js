@@ -1,6 +1,35 @@
 import * as msgpack from '@msgpack/msgpack';
 import { Mutex } from 'async-mutex';
 
+// Must match NDARRAY_EXT_TYPE in seedoo/streamlit/serialization.py
+const NDARRAY_EXT_TYPE = 1;
+const TYPED_ARRAYS = {
+  b1: Uint8Array,
+  i1: Int8Array,
+  u1: Uint8Array,
+  i2: Int16Array,
+  u2: Uint16Array,
+  i4: Int32Array,
+  u4: Uint32Array,
+  i8: BigInt64Array,
+  u8: BigUint64Array,
+  f4: Float32Array,
+  f8: Float64Array,
+};
+
+const extensionCodec = new msgpack.ExtensionCodec();
+extensionCodec.register({
+  type: NDARRAY_EXT_TYPE,
+  encode: () => null,
+  decode: (data) => {
+    // numpy arrays arrive as [dtype, shape, little-endian bytes]
+    const [dtype, shape, bytes] = msgpack.decode(data);
+    const ArrayType = TYPED_ARRAYS[dtype.slice(1)];
+    const buffer = bytes.slice().buffer; // copy so the typed array is aligned
+    return { dtype, shape, data: new ArrayType(buffer) };
+  },
+});
+
 class WebSocketWrapper {
   static instances = {};
   listeners = [];
@@ -10,23 +39,26 @@ class WebSocketWrapper {
   spinnerVisible = false; // Track spinner visibility
   spinnerQueue = [];
   spinnerMutex = new Mutex(); // Mutex for managing spinner queue
+  pendingRequests = {}; // request_id -> {resolve, reject, timer, responses} of requests sent with request()
+  requestCounter = 0;
 
-  constructor(port, component_id, spinner = false) {
+  constructor(port, component_id, spinner = false, encoding = 'json') {
     this.ip = window.location.hostname;
     this.port = port;
     this.component_id = component_id;
     this.spinnerEnabled = spinner;
+    this.encoding = encoding; // 'json' or 'msgpack', negotiated with the server for pushed messages
     this.pendingMessages = [];
     this.creation_time = Date.now();
     this.createSpinner(); // Create spinner instance
     this.connect();
   }
 
-  static getInstance(port, component_id, spinner = false) {
+  static getInstance(port, component_id, spinner = false, encoding = 'json') {
     const key = `${port}:${component_id}`;
     console.log('Getting key:', key);
     if (!WebSocketWrapper.instances[key]) {
-      WebSocketWrapper.instances[key] = new WebSocketWrapper(port, component_id, spinner);
+      WebSocketWrapper.instances[key] = new WebSocketWrapper(port, component_id, spinner, encoding);
     } else {
       WebSocketWrapper.instances[key].cleanup();
       WebSocketWrapper.instances[key].connect();
@@ -165,14 +197,60 @@ class WebSocketWrapper {
 
       if (typeof event.data === 'string') {
         const message = JSON.parse(event.data);
-        this.listeners.forEach(listener => listener(message));
+        this.dispatchMessage(message);
       } else {
-        const data = msgpack.decode(new Uint8Array(event.data));
-        this.listeners.forEach(listener => listener(data));
+        const data = msgpack.decode(new Uint8Array(event.data), { extensionCodec });
+        this.dispatchMessage(data);
       }
     };
   }
 
+  dispatchMessage(message) {
+    // The server may coalesce a burst of pushes into one {event: 'batch', data: [...]} frame
+    if (message && message.event === 'batch' && Array.isArray(message.data)) {
+      message.data.forEach(item => this.dispatchMessage(item));
+      return;
+    }
+    const pending = message && message.request_id !== undefined ? this.pendingRequests[message.request_id] : undefined;
+    if (pending) {
+      if (message.event === 'callback_done') {
+        this.settleRequest(message.request_id, pending, () => pending.resolve(pending.responses));
+        return;
+      }
+      if (message.event === 'message' && message.data && message.data.type === 'error') {
+        this.settleRequest(message.request_id, pending, () => pending.reject(message.data));
+      } else {
+        pending.responses.push(message);
+      }
+    }
+    this.listeners.forEach(listener => listener(message));
+  }
+
+  settleRequest(request_id, pending, settle) {
+    clearTimeout(pending.timer);
+    delete this.pendingRequests[request_id];
+    settle();
+  }
+
+  // Sends data tagged with a request_id and resolves with the messages tagged with it on this connection once
+  // the server acknowledges the callback. Requests with the same orderKey (the component id by default) run
+  // in order on the server, null lets the request run alongside any other.
+  request(data, orderKey = undefined, timeoutMs = 30000) {
+    const request_id = `${this.component_id}:${this.creation_time.toString(36)}:${this.requestCounter++}`;
+    const message = { ...data, request_id };
+    if (orderKey !== undefined) {
+      message['order_key'] = orderKey;
+    }
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        delete this.pendingRequests[request_id];
+        reject(new Error(`Request ${request_id} timed out after ${timeoutMs} ms`));
+      }, timeoutMs);
+      this.pendingRequests[request_id] = { resolve, reject, timer, responses: [] };
+      this.sendData(message);
+    });
+  }
+
   retryConnection() {
     if (this.retryCount < this.maxRetries) {
       this.retryCount++;
@@ -217,6 +295,7 @@ class WebSocketWrapper {
     }catch (e){
       console.log('not login')
     }
+    new_data['encoding'] = this.encoding
     const jsonString = JSON.stringify(new_data);
 
     if (this.ws.readyState === WebSocket.OPEN) {
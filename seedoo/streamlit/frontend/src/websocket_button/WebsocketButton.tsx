@@ -38,9 +38,13 @@ class WebsocketButton extends StreamlitComponentBase<State> {
 
     if (this.wsWrapper != null) {
         console.log(newState , 'newState')
-      this.wsWrapper.sendData(newState);
+      // Keep the spinner until the server acknowledges the callback
+      this.wsWrapper.request(newState)
+        .catch((error: any) => console.error('Callback failed:', error))
+        .finally(() => this.setState({ ...this.state, spinner: false }));
+    } else {
+      this.setState({ ...this.state, spinner: false });
     }
-    this.setState({ ...this.state ,spinner:false});
   };
 
   public render = (): React.ReactNode => {
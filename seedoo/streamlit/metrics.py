@@ -0,0 +1,135 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in milliseconds, roughly logarithmic from sub-millisecond encodes to minute long tasks
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000,
+                      math.inf)
+OVERFLOW_LABEL = 'other'
+
+
+class Histogram:
+    """Fixed bucket latency histogram, cheap enough to update on every message."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Estimates the q-th percentile (0-100) by interpolating inside the bucket that holds it."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = min(self.buckets[index], self.max)
+                return lower + (upper - lower) * max(0.0, rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class MetricsRegistry:
+    """
+    In-memory latency histograms keyed by metric name and labels.
+
+    Shared by the TrackingThreadPoolExecutor and the WebSocketServer. Values are in milliseconds.
+    Label sets beyond `max_series` per metric are folded into a single 'other' series so
+    per-key metrics can not grow without bound.
+    """
+
+    def __init__(self, prefix='seedoo', max_series=5000):
+        self.prefix = prefix
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        self._histograms = {}  # name -> {labels tuple -> Histogram}
+
+    def observe(self, name, value, **labels):
+        label_key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.get(name)
+            if series is None:
+                series = self._histograms[name] = {}
+            histogram = series.get(label_key)
+            if histogram is None:
+                if len(series) >= self.max_series:
+                    label_key = tuple((label, OVERFLOW_LABEL) for label, _ in label_key)
+                    histogram = series.get(label_key)
+                if histogram is None:
+                    histogram = series[label_key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, **labels)
+
+    def histogram(self, name, **labels):
+        with self._lock:
+            return self._histograms.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def stats(self, name=None):
+        """
+        Returns {metric: [{'labels': {...}, 'count': ..., 'mean': ..., 'p50': ..., ...}]}.
+
+        Args:
+            name (Optional[str]): Only return this metric.
+        """
+        with self._lock:
+            names = [name] if name is not None else list(self._histograms)
+            return {metric: [dict(labels=dict(label_key), **histogram.snapshot())
+                             for label_key, histogram in self._histograms.get(metric, {}).items()]
+                    for metric in names}
+
+    def render_prometheus(self):
+        """Renders all histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                metric = f'{self.prefix}_{name}'
+                lines.append(f'# TYPE {metric} histogram')
+                for label_key, histogram in series.items():
+                    labels = ','.join(f'{label}="{_escape(value)}"' for label, value in label_key)
+                    cumulative = 0
+                    for bucket, bucket_count in zip(histogram.buckets, histogram.counts):
+                        cumulative += bucket_count
+                        le = '+Inf' if bucket == math.inf else repr(bucket)
+                        bucket_labels = f'{labels},le="{le}"' if labels else f'le="{le}"'
+                        lines.append(f'{metric}_bucket{{{bucket_labels}}} {cumulative}')
+                    suffix = f'{{{labels}}}' if labels else ''
+                    lines.append(f'{metric}_sum{suffix} {histogram.sum}')
+                    lines.append(f'{metric}_count{suffix} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
@@ -0,0 +1,250 @@
+import asyncio
+import collections
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from seedoo.streamlit.metrics import MetricsRegistry
+
+PRIORITY_UI = 0  # Component callbacks the user is waiting on, e.g. button clicks
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+_QUEUED = 0
+_RUNNING = 1
+_DONE = 2
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing a request when the queue of its user or of the whole scheduler is full."""
+
+    def __init__(self, message: str, retry_after_ms: float):
+        super().__init__(message)
+        self.retry_after_ms = retry_after_ms
+
+
+class _Request:
+    __slots__ = ('user', 'function', 'priority', 'tag', 'future', 'state', 'enqueued_at')
+
+    def __init__(self, user: Hashable, function: str, priority: int, tag: float, future: asyncio.Future):
+        self.user = user
+        self.function = function
+        self.priority = priority
+        self.tag = tag  # virtual start time, the smallest tag of a priority runs first
+        self.future = future
+        self.state = _QUEUED
+        self.enqueued_at = time.monotonic()
+
+
+class _User:
+    __slots__ = ('queues', 'queued', 'running', 'finish', 'weight')
+
+    def __init__(self, weight: float):
+        self.queues: Dict[int, collections.deque] = {}  # priority -> requests in arrival order
+        self.queued = 0
+        self.running = 0
+        self.finish = 0.0  # virtual time at which the work queued so far is served
+        self.weight = weight
+
+
+class FairScheduler:
+    """
+    Admits the work of the websocket server to its executors in a fair order.
+
+    Requests are ordered by priority first and then by start-time fair queuing across users. Each request
+    is tagged with max(virtual time, the previous tag of its user) + 1 / weight, and the virtual time
+    follows the tags being served. A user with a long backlog therefore gets its turn once per round,
+    like every other user, instead of holding the executor for its whole backlog.
+
+    A request runs once the total concurrency, the concurrency of its user and the concurrency of its
+    function are all under their caps. `reserved_ui` slots of the total can only be taken by PRIORITY_UI
+    requests, so clicks are served even while functions saturate the pool. Queues are bounded per user
+    and overall; a request that does not fit raises Overloaded right away, so callers can answer the
+    client instead of letting latency grow without limit.
+
+    Not thread-safe: all calls must come from the event loop the scheduler serves.
+    """
+
+    def __init__(self, max_concurrency: int = 80, per_user: int = 8, per_function: int = 32,
+                 max_queue_per_user: int = 100, max_queued: int = 5000, reserved_ui: Optional[int] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        self.max_concurrency = max_concurrency
+        self.per_user = per_user
+        self.per_function = per_function
+        self.max_queue_per_user = max_queue_per_user
+        self.max_queued = max_queued
+        self.reserved_ui = max_concurrency // 10 if reserved_ui is None else reserved_ui
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.logger = logging.getLogger(__name__)
+        self.function_limits: Dict[str, int] = {}
+        self.weights: Dict[Hashable, float] = {}
+        self._users: Dict[Hashable, _User] = {}
+        self._waiting: Dict[int, set] = {}  # priority -> users with queued requests of that priority
+        self._functions = collections.Counter()  # function -> running requests
+        self._running = 0
+        self._queued = 0
+        self._virtual_time = 0.0
+        self._service_ms = 10.0  # moving average of run times, for the retry hint of Overloaded
+        self.dispatched = 0
+        self.shed = 0
+
+    def set_function_limit(self, function: str, limit: Optional[int]) -> None:
+        """Overrides per_function for one function, None restores the default."""
+        if limit is None:
+            self.function_limits.pop(function, None)
+        else:
+            self.function_limits[function] = limit
+
+    def set_weight(self, user: Hashable, weight: float) -> None:
+        """Gives a user weight times the share of a user with the default weight of 1."""
+        self.weights[user] = weight
+        if user in self._users:
+            self._users[user].weight = weight
+
+    async def run(self, user: Hashable, function: str, fn: Callable[[], Awaitable[Any]],
+                  priority: int = PRIORITY_NORMAL) -> Any:
+        """
+        Waits for a slot, then returns await fn().
+
+        Args:
+            user (Hashable): Who the work is done for, fairness and the per-user cap apply to it.
+            function (str): Name of the function or callback, for the per-function cap and metrics.
+            fn (Callable[[], Awaitable[Any]]): Starts the work, e.g. a run_in_executor call.
+            priority (int): PRIORITY_UI, PRIORITY_NORMAL or PRIORITY_BACKGROUND.
+
+        Raises:
+            Overloaded: The queue of the user or of the scheduler is full.
+        """
+        request = self._enqueue(user, function, priority)
+        self._dispatch()
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            if request.state == _RUNNING:
+                self._release(request)
+            else:
+                self._remove(request)
+            raise
+        start = time.monotonic()
+        try:
+            return await fn()
+        finally:
+            self._service_ms += ((time.monotonic() - start) * 1000 - self._service_ms) * 0.05
+            self._release(request)
+
+    def _enqueue(self, user_id: Hashable, function: str, priority: int) -> _Request:
+        user = self._users.get(user_id)
+        if user is not None and user.queued >= self.max_queue_per_user:
+            self._shed(f'Too many pending requests for user {user_id}', user.queued, self.per_user)
+        if self._queued >= self.max_queued:
+            self._shed('Server queue is full', self._queued, self.max_concurrency)
+        if user is None:
+            user = self._users[user_id] = _User(self.weights.get(user_id, 1.0))
+        tag = max(self._virtual_time, user.finish)
+        user.finish = tag + 1 / user.weight
+        request = _Request(user_id, function, priority, tag, asyncio.get_running_loop().create_future())
+        user.queues.setdefault(priority, collections.deque()).append(request)
+        user.queued += 1
+        self._queued += 1
+        self._waiting.setdefault(priority, set()).add(user_id)
+        return request
+
+    def _shed(self, reason: str, backlog: int, concurrency: int):
+        self.shed += 1
+        # Time to drain the backlog at the current run times, only a hint for the client
+        retry_after_ms = self._service_ms * max(1.0, backlog / max(1, concurrency))
+        self.logger.warning(f'Shedding request: {reason}')
+        raise Overloaded(reason, retry_after_ms)
+
+    def _unqueue(self, request: _Request) -> _User:
+        user = self._users[request.user]
+        queue = user.queues[request.priority]
+        if queue[0] is request:
+            queue.popleft()
+        else:
+            queue.remove(request)
+        if not queue:
+            del user.queues[request.priority]
+            waiting = self._waiting[request.priority]
+            waiting.discard(request.user)
+            if not waiting:
+                del self._waiting[request.priority]
+        user.queued -= 1
+        self._queued -= 1
+        return user
+
+    def _forget_if_idle(self, user_id: Hashable, user: _User) -> None:
+        if not user.queued and not user.running:
+            del self._users[user_id]
+
+    def _remove(self, request: _Request) -> None:
+        """Drops a request whose caller stopped waiting before it got a slot."""
+        if request.state != _QUEUED:
+            return
+        request.state = _DONE
+        self._forget_if_idle(request.user, self._unqueue(request))
+
+    def _limit(self, function: str) -> int:
+        return self.function_limits.get(function, self.per_function)
+
+    def _select(self) -> Optional[_Request]:
+        for priority in sorted(self._waiting):
+            if priority != PRIORITY_UI and self._running >= self.max_concurrency - self.reserved_ui:
+                return None
+            best = None
+            for user_id in self._waiting[priority]:
+                user = self._users[user_id]
+                if user.running >= self.per_user:
+                    continue
+                head = user.queues[priority][0]
+                if self._functions[head.function] >= self._limit(head.function):
+                    continue
+                if best is None or head.tag < best.tag:
+                    best = head
+            if best is not None:
+                return best
+        return None
+
+    def _dispatch(self) -> None:
+        while self._queued and self._running < self.max_concurrency:
+            request = self._select()
+            if request is None:
+                return
+            user = self._unqueue(request)
+            if request.future.cancelled():
+                request.state = _DONE
+                self._forget_if_idle(request.user, user)
+                continue
+            request.state = _RUNNING
+            user.running += 1
+            self._functions[request.function] += 1
+            self._running += 1
+            self._virtual_time = max(self._virtual_time, request.tag)
+            self.dispatched += 1
+            self.metrics.observe('scheduler_wait_ms', (time.monotonic() - request.enqueued_at) * 1000,
+                                 function=request.function)
+            request.future.set_result(None)
+
+    def _release(self, request: _Request) -> None:
+        if request.state != _RUNNING:
+            return
+        request.state = _DONE
+        user = self._users[request.user]
+        user.running -= 1
+        self._functions[request.function] -= 1
+        if not self._functions[request.function]:
+            del self._functions[request.function]
+        self._running -= 1
+        self._forget_if_idle(request.user, user)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            'running': self._running,
+            'queued': self._queued,
+            'users': len(self._users),
+            'dispatched': self.dispatched,
+            'shed': self.shed,
+            'running_per_function': dict(self._functions),
+            'queued_per_user': {user_id: user.queued for user_id, user in self._users.items() if user.queued},
+        }
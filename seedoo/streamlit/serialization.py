@@ -0,0 +1,107 @@
+import json
+from collections.abc import Mapping
+
+import msgpack
+import numpy as np
+
+ENCODING_JSON = 'json'
+ENCODING_MSGPACK = 'msgpack'
+ENCODINGS = (ENCODING_JSON, ENCODING_MSGPACK)
+
+# msgpack extension carrying a numpy array as [dtype, shape, raw little-endian bytes]
+NDARRAY_EXT_TYPE = 1
+# dtype kinds the frontend can map onto a JavaScript TypedArray
+_TYPED_ARRAY_KINDS = ('b', 'i', 'u', 'f')
+
+
+class CustomJSONEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return float(obj)
+        if isinstance(obj, np.ndarray):
+            return obj.astype(int).tolist()
+        if isinstance(obj, Mapping):
+            # Read-only state snapshots
+            return dict(obj)
+        return super(CustomJSONEncoder, self).default(obj)
+
+
+def msgpack_default(obj):
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind not in _TYPED_ARRAY_KINDS or obj.dtype == np.float16:
+            return obj.tolist()
+        array = np.ascontiguousarray(obj)
+        if array.dtype.byteorder == '>':
+            array = array.astype(array.dtype.newbyteorder('<'))
+        # ascontiguousarray turns a 0-d array into a 1-d one, the shape is the original's
+        header = [array.dtype.str, list(obj.shape)]
+        # A view with a zero in its shape can not be cast to bytes
+        buffer = memoryview(array).cast('B') if array.size else array.tobytes()
+        return msgpack.ExtType(NDARRAY_EXT_TYPE, msgpack.packb(header + [buffer], use_bin_type=True))
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not msgpack serializable')
+
+
+def msgpack_ext_hook(code, data):
+    if code == NDARRAY_EXT_TYPE:
+        dtype, shape, buffer = msgpack.unpackb(data, raw=False)
+        return np.frombuffer(buffer, dtype=np.dtype(dtype)).reshape(shape)
+    return msgpack.ExtType(code, data)
+
+
+def encode(data, encoding=ENCODING_JSON):
+    """Encodes a pushed message as a JSON string or msgpack bytes."""
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(data, default=msgpack_default, use_bin_type=True)
+    return json.dumps(data, cls=CustomJSONEncoder)
+
+
+def decode(payload):
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return msgpack.unpackb(payload, ext_hook=msgpack_ext_hook, raw=False)
+    return json.loads(payload)
+
+
+def encode_response(response, binary=False):
+    """Encodes a /ws/functions response the way the client asked for it with the 'binary' flag."""
+    if binary:
+        return msgpack.packb(response, default=msgpack_default, use_bin_type=True)
+    return json.dumps(response, cls=CustomJSONEncoder)
+
+
+def wrap_response(payload, request_id, binary=False):
+    """Wraps an encoded /ws/functions response into {'request_id': ..., 'data': ...} without re-encoding it."""
+    if binary:
+        packer = msgpack.Packer(use_bin_type=True)
+        return b''.join([packer.pack_map_header(2), packer.pack('request_id'), packer.pack(request_id),
+                         packer.pack('data'), payload])
+    return '{"request_id": ' + json.dumps(request_id) + ', "data": ' + payload + '}'
+
+
+def call_and_encode(target_function, message_data):
+    """
+    Runs a registered function and encodes its response in the calling process.
+
+    Used as the process pool entry point, so the CPU cost of both the call and the
+    serialization stays out of the server process and only the payload travels back.
+    """
+    response = target_function(message_data)
+    return encode_response(response, message_data.get('binary'))
+
+
+def frame_batch(payloads, encoding=ENCODING_JSON):
+    """Wraps already encoded messages into one {'event': 'batch', 'data': [...]} frame without re-encoding them."""
+    if encoding == ENCODING_MSGPACK:
+        packer = msgpack.Packer(use_bin_type=True)
+        return b''.join([packer.pack_map_header(2), packer.pack('event'), packer.pack('batch'), packer.pack('data'),
+                         packer.pack_array_header(len(payloads))] + list(payloads))
+    return '{"event": "batch", "data": [' + ','.join(payloads) + ']}'
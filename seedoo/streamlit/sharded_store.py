@@ -0,0 +1,188 @@
+import collections
+import math
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class _Shard:
+    __slots__ = ('lock', 'entries', 'wheel', 'slot_of', 'wheel_tick', 'sweep_at')
+
+    def __init__(self, slots: int, tick: int, resolution: float):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # key -> (value, expires_at), least recently used first
+        self.wheel = [set() for _ in range(slots)]  # keys by the slot of their expiry
+        self.slot_of = {}  # key -> wheel slot it is registered in
+        self.wheel_tick = tick  # first tick whose slot has not been swept yet
+        self.sweep_at = tick * resolution  # operations before this time have nothing to sweep
+
+
+class ShardedTTLStore:
+    """
+    Thread-safe LRU mapping with a max age, split into independently locked shards.
+
+    A key only ever takes the lock of its own shard, so readers and writers of different keys rarely
+    contend. Expired entries are reclaimed through a timing wheel: every entry is registered in the
+    slot of its expiry tick and each operation sweeps only the slots that elapsed since the last one,
+    instead of scanning the shard. Reads also check the exact expiry, so the wheel resolution
+    (max_age / wheel_slots) only delays reclaiming memory.
+
+    `update` and `setdefault` run their read-modify-write under the shard lock, so concurrent updates of
+    one key are never lost.
+    """
+
+    def __init__(self, capacity: int = 5000, max_age: float = 86400, shards: int = 16, wheel_slots: int = 256):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.shards_count = shards
+        self.shard_capacity = max(1, math.ceil(capacity / shards))
+        self.resolution = max_age / wheel_slots
+        # One slot more than max_age needs, so a fresh expiry never lands in the slot being swept
+        self.wheel_slots = wheel_slots + 1
+        tick = self._tick(time.monotonic())
+        self._shards = [_Shard(self.wheel_slots, tick, self.resolution) for _ in range(shards)]
+
+    def _tick(self, at: float) -> int:
+        return int(at // self.resolution)
+
+    def _shard(self, key: Hashable) -> _Shard:
+        return self._shards[hash(key) % self.shards_count]
+
+    # The helpers below expect the shard lock to be held
+
+    def _sweep(self, shard: _Shard, now: float) -> None:
+        if now < shard.sweep_at:
+            return
+        current = self._tick(now)
+        # After an idle period longer than a full turn each slot is visited once
+        for tick in range(max(shard.wheel_tick, current - self.wheel_slots + 1), current + 1):
+            bucket = shard.wheel[tick % self.wheel_slots]
+            if not bucket:
+                continue
+            for key in [k for k in bucket if shard.entries[k][1] <= now]:
+                self._remove(shard, key)
+        shard.wheel_tick = max(shard.wheel_tick, current + 1)
+        shard.sweep_at = shard.wheel_tick * self.resolution
+
+    def _remove(self, shard: _Shard, key: Hashable) -> None:
+        del shard.entries[key]
+        shard.wheel[shard.slot_of.pop(key)].discard(key)
+
+    def _store(self, shard: _Shard, key: Hashable, value: Any, now: float) -> None:
+        expires_at = now + self.max_age
+        slot = math.ceil(expires_at / self.resolution) % self.wheel_slots
+        previous = shard.slot_of.get(key)
+        if previous is not None and previous != slot:
+            shard.wheel[previous].discard(key)
+        shard.wheel[slot].add(key)
+        shard.slot_of[key] = slot
+        shard.entries[key] = (value, expires_at)
+        shard.entries.move_to_end(key)
+        while len(shard.entries) > self.shard_capacity:
+            self._remove(shard, next(iter(shard.entries)))
+
+    def _lookup(self, shard: _Shard, key: Hashable, now: float):
+        entry = shard.entries.get(key)
+        if entry is None:
+            return _MISSING
+        if entry[1] <= now:
+            self._remove(shard, key)
+            return _MISSING
+        shard.entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        shard = self._shards[hash(key) % self.shards_count]
+        now = time.monotonic()
+        with shard.lock:
+            if now >= shard.sweep_at:
+                self._sweep(shard, now)
+            entry = shard.entries.get(key)
+            if entry is not None and entry[1] > now:
+                shard.entries.move_to_end(key)
+                return entry[0]
+            if entry is not None:
+                self._remove(shard, key)
+        return default
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            self._sweep(shard, now)
+            self._store(shard, key, value, now)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            value = self._lookup(shard, key, now)
+            if value is not _MISSING:
+                self._remove(shard, key)
+        return default if value is _MISSING else value
+
+    def __delitem__(self, key: Hashable) -> None:
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def setdefault(self, key: Hashable, default: Any = None) -> Any:
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            self._sweep(shard, now)
+            value = self._lookup(shard, key, now)
+            if value is _MISSING:
+                value = default
+                self._store(shard, key, value, now)
+        return value
+
+    def update(self, key: Hashable, fn: Callable[[Any], Any],
+               default_factory: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Atomically replaces the value of key with fn(current value) and returns the new value.
+
+        Args:
+            default_factory (Optional[Callable[[], Any]]): Builds the current value of a missing key,
+                a missing key is passed to fn as None without it.
+        """
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            self._sweep(shard, now)
+            current = self._lookup(shard, key, now)
+            if current is _MISSING:
+                current = default_factory() if default_factory is not None else None
+            value = fn(current)
+            self._store(shard, key, value, now)
+        return value
+
+    def __len__(self) -> int:
+        total = 0
+        now = time.monotonic()
+        for shard in self._shards:
+            with shard.lock:
+                self._sweep(shard, now)
+                total += len(shard.entries)
+        return total
+
+    def clear(self) -> None:
+        tick = self._tick(time.monotonic())
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.slot_of.clear()
+                for bucket in shard.wheel:
+                    bucket.clear()
+                shard.wheel_tick = tick
+                shard.sweep_at = tick * self.resolution
@@ -0,0 +1,91 @@
+import asyncio
+import collections
+import hashlib
+import json
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+# Fields that differ between otherwise identical calls without changing their result
+VOLATILE_FIELDS = frozenset(('request_id', 'accessToken', 'encoding', 'session_state', 'user_state'))
+
+
+def request_key(function_name: str, message_data: dict) -> bytes:
+    """
+    Returns a canonical hash of a /ws/functions call.
+
+    The message is hashed with sorted keys and without VOLATILE_FIELDS. session_id and user_id stay in
+    the key, and the versions of the session and user state looked up for the call are added, so a cached
+    result is not served once the state a function may read has changed.
+    """
+    canonical = {key: value for key, value in message_data.items() if key not in VOLATILE_FIELDS}
+    states = [getattr(message_data.get(name), 'version', None) for name in ('session_state', 'user_state')]
+    body = json.dumps([function_name, canonical, states], sort_keys=True, separators=(',', ':'), default=repr)
+    return hashlib.blake2b(body.encode(), digest_size=16).digest()
+
+
+class SingleFlight:
+    """
+    Shares one execution between concurrent identical calls.
+
+    The first call for a key starts the work as a task of its own, later calls for the key wait for that
+    task. A caller being cancelled does not cancel the work for the others. Not thread-safe: all calls
+    must come from one event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> task
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.executed += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, so a failure nobody waits for any more is not reported as unhandled
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class ResultCache:
+    """LRU of encoded /ws/functions responses with a TTL per entry. Not thread-safe, used on the server loop."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # key -> (expires_at, payload)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, payload: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
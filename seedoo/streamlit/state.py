@@ -0,0 +1,90 @@
+from collections.abc import Mapping
+from typing import Any, Hashable, Iterable, Iterator, Optional
+
+
+class FrozenState(Mapping):
+    """
+    Immutable, versioned snapshot of a session or user state.
+
+    Snapshots are attached to websocket messages as they are, so callbacks running concurrently on the
+    pool read a consistent view without locks or copies. Changes never modify a snapshot: `set`,
+    `update`, `remove` and `set_in` return a new one with the version incremented, sharing every value
+    that did not change. OurTokensStore publishes the new snapshot atomically.
+
+    Values are shared, not copied, so nested values should be treated as read-only as well;
+    `set_in` replaces a nested value by copying only the dicts along its path.
+    """
+
+    __slots__ = ('_data', '_version')
+
+    def __init__(self, data: Optional[Mapping] = None, version: int = 0):
+        object.__setattr__(self, '_data', dict(data) if data else {})
+        object.__setattr__(self, '_version', version)
+
+    @classmethod
+    def of(cls, state: Optional[Mapping]) -> 'FrozenState':
+        """Returns state itself if it is already a snapshot, a snapshot of it otherwise."""
+        return state if isinstance(state, FrozenState) else cls(state)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def __getitem__(self, key: Hashable) -> Any:
+        return self._data[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError('FrozenState is immutable, use set() to get an updated snapshot')
+
+    def __reduce__(self):
+        return FrozenState, (self._data, self._version)
+
+    def __repr__(self) -> str:
+        return f'FrozenState({self._data!r}, version={self._version})'
+
+    def _evolve(self, data: dict) -> 'FrozenState':
+        return FrozenState(data, self._version + 1)
+
+    def set(self, key: Hashable, value: Any) -> 'FrozenState':
+        data = dict(self._data)
+        data[key] = value
+        return self._evolve(data)
+
+    def update(self, changes: Optional[Mapping] = None, **kwargs) -> 'FrozenState':
+        data = dict(self._data)
+        data.update(changes or {}, **kwargs)
+        return self._evolve(data)
+
+    def remove(self, key: Hashable) -> 'FrozenState':
+        if key not in self._data:
+            return self
+        data = dict(self._data)
+        del data[key]
+        return self._evolve(data)
+
+    def set_in(self, path: Iterable[Hashable], value: Any) -> 'FrozenState':
+        """Replaces the value at a path of nested dicts, e.g. set_in(('filters', 'status'), 'done')."""
+        path = tuple(path)
+        if not path:
+            raise ValueError('set_in needs a non-empty path')
+
+        def assoc(node: Optional[Mapping], depth: int) -> dict:
+            copy = dict(node) if isinstance(node, Mapping) else {}
+            key = path[depth]
+            copy[key] = value if depth == len(path) - 1 else assoc(copy.get(key), depth + 1)
+            return copy
+
+        return self._evolve(assoc(self._data, 0))
+
+    def to_dict(self) -> dict:
+        """Returns a shallow, mutable copy."""
+        return dict(self._data)
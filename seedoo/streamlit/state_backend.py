@@ -0,0 +1,197 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+from seedoo.streamlit.sharded_store import ShardedTTLStore
+
+_MISSING = object()
+# Cached marker for keys known to be absent, so invalid tokens do not reach SQLite on every message
+_ABSENT = object()
+
+
+class MemoryBackend:
+    """Keeps every namespace in a ShardedTTLStore of this process, the default for a single Streamlit process."""
+
+    def __init__(self, capacity: int = 5000, max_age: float = 86400, shards: int = 16):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.shards = shards
+        self._lock = threading.Lock()
+        self._namespaces = {}
+
+    def namespace(self, name: str) -> ShardedTTLStore:
+        with self._lock:
+            if name not in self._namespaces:
+                self._namespaces[name] = ShardedTTLStore(capacity=self.capacity, max_age=self.max_age,
+                                                         shards=self.shards)
+            return self._namespaces[name]
+
+
+class SQLiteBackend:
+    """
+    Stores every namespace in one SQLite database in WAL mode, shared by the processes of a host.
+
+    Values are pickled, keys are stored as strings. Reads go through an in-process ShardedTTLStore.
+    The cache is dropped whenever `PRAGMA data_version` shows that another process committed, which is
+    checked at most every `check_interval` seconds. Writes go to SQLite first and then to the cache;
+    `update` runs its read-modify-write inside BEGIN IMMEDIATE, so it is atomic across processes too.
+
+    Trust boundary: values are read back with `pickle.loads`, which runs code chosen by whoever wrote the
+    row. Anyone able to write to the database file (or its -wal and -shm files) can therefore execute code
+    in every process using it. Keep the file in a directory only the Streamlit processes' user can write to;
+    a new database is created with mode 0600 for that reason. Never point it at a shared or world-writable
+    location.
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str, max_age: float = 86400, cache_capacity: int = 5000, check_interval: float = 0.05,
+                 timeout: float = 5.0):
+        self.path = path
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        if path != ':memory:' and not os.path.exists(path):
+            # Owner only, SQLite gives the -wal and -shm files the same mode
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        # One connection, so data_version only changes for commits of other processes
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entries (namespace TEXT NOT NULL, key TEXT NOT NULL, '
+                                 'value BLOB NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))')
+        self._data_version = self._read_data_version()
+        self._checked_at = time.monotonic()
+        # (namespace, key) -> (value, expires_at)
+        self._cache = ShardedTTLStore(capacity=cache_capacity, max_age=max_age)
+        self._writes = 0
+
+    def namespace(self, name: str) -> 'BackendNamespace':
+        return BackendNamespace(self, name)
+
+    def _read_data_version(self) -> int:
+        return self._connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def _validate_cache(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            version = self._read_data_version()
+            if version != self._data_version:
+                self._data_version = version
+                self._cache.clear()
+
+    def get(self, namespace: str, key: Hashable, default: Any = None) -> Any:
+        self._validate_cache()
+        cache_key = (namespace, str(key))
+        cached = self._cache.get(cache_key)
+        if cached is None:
+            # Filled under the lock, so a concurrent write can not be overwritten by the older row
+            with self._lock:
+                row = self._connection.execute(
+                    'SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?', cache_key).fetchone()
+                cached = (pickle.loads(row[0]), row[1]) if row is not None else (_ABSENT, time.time() + self.max_age)
+                self._cache[cache_key] = cached
+        value, expires_at = cached
+        if value is _ABSENT or expires_at <= time.time():
+            return default
+        return value
+
+    def update(self, namespace: str, key: Hashable, fn: Callable[[Any], Any],
+               default_factory: Optional[Callable[[], Any]] = None, only_missing: bool = False) -> Any:
+        """
+        Atomically replaces the value of key with fn(current value) and returns the new value.
+
+        Args:
+            only_missing (bool): Keep and return an existing value instead of calling fn, for setdefault.
+        """
+        cache_key = (namespace, str(key))
+        with self._lock:
+            now = time.time()
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute(
+                    'SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?', cache_key).fetchone()
+                if row is not None and row[1] > now:
+                    current = pickle.loads(row[0])
+                    if only_missing:
+                        self._connection.execute('COMMIT')
+                        self._cache[cache_key] = (current, row[1])
+                        return current
+                else:
+                    current = default_factory() if default_factory is not None else None
+                value = fn(current)
+                expires_at = now + self.max_age
+                self._connection.execute(
+                    'INSERT INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (namespace, key) DO UPDATE SET '
+                    'value = excluded.value, expires_at = excluded.expires_at',
+                    cache_key + (pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires_at))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._cache[cache_key] = (value, expires_at)
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self.purge()
+        return value
+
+    def delete(self, namespace: str, key: Hashable) -> None:
+        cache_key = (namespace, str(key))
+        with self._lock:
+            self._connection.execute('DELETE FROM entries WHERE namespace = ? AND key = ?', cache_key)
+            self._cache[cache_key] = (_ABSENT, time.time() + self.max_age)
+
+    def purge(self) -> None:
+        """Deletes expired rows, done every PURGE_EVERY writes."""
+        with self._lock:
+            self._connection.execute('DELETE FROM entries WHERE expires_at <= ?', (time.time(),))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class BackendNamespace:
+    """Mapping view of one namespace of a SQLiteBackend, with the methods OurTokensStore uses on a ShardedTTLStore."""
+
+    def __init__(self, backend: SQLiteBackend, name: str):
+        self.backend = backend
+        self.name = name
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self.backend.get(self.name, key, default)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.backend.update(self.name, key, lambda _: value)
+
+    def setdefault(self, key: Hashable, default: Any = None) -> Any:
+        return self.backend.update(self.name, key, lambda _: default, only_missing=True)
+
+    def update(self, key: Hashable, fn: Callable[[Any], Any],
+               default_factory: Optional[Callable[[], Any]] = None) -> Any:
+        return self.backend.update(self.name, key, fn, default_factory)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        value = self.get(key, _MISSING)
+        self.backend.delete(self.name, key)
+        return default if value is _MISSING else value
+
+    def __delitem__(self, key: Hashable) -> None:
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
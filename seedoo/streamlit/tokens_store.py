@@ -1,6 +1,11 @@
+import os
 import streamlit as st
 from datetime import datetime, timedelta
-from seedoo.collections.capped_cahes import LRUCache
+from seedoo.streamlit.state import FrozenState
+from seedoo.streamlit.state_backend import MemoryBackend, SQLiteBackend
+
+# Path of a SQLite database shared by every Streamlit process of the host, in-process memory when unset
+TOKENS_STORE_PATH_ENV = 'SEEDOO_TOKENS_STORE_PATH'
 
 
 class OurTokensStore:
@@ -9,10 +14,20 @@ class OurTokensStore:
 
        This class provides methods to add, retrieve, and manage tokens and session states
        with a Least Recently Used (LRU) cache that has a specified maximum age for entries.
+       The caches are sharded and thread-safe. Session and user states are immutable FrozenState
+       snapshots: the set_*_data and update_*_state methods publish a new version atomically, so a
+       snapshot handed to a callback is never modified while it reads it.
+
+       The states live in a backend: in-process memory by default, or a SQLite database shared by
+       several Streamlit processes when `path` (or the SEEDOO_TOKENS_STORE_PATH environment variable)
+       is set, so a token issued by one process is accepted by the websocket server of another.
 
        Attributes:
-           data (LRUCache): An LRU cache to store tokens with a capacity of 5000 entries and a max age of 86400 seconds (1 day).
-           session_state (LRUCache): An LRU cache to store session states with a capacity of 5000 entries and a max age of 86400 seconds (1 day).
+           data (ShardedTTLStore): Tokens, `capacity` entries with a max age of `max_age` seconds (1 day by default).
+           session_state (ShardedTTLStore): Session states, with the same capacity and max age.
+           user_stor (ShardedTTLStore): User states, with the same capacity and max age.
+           With the SQLite backend these are BackendNamespace views with the same methods and `capacity`
+           bounds the in-process read cache.
 
        Methods:
            add(token):
@@ -36,32 +51,34 @@ class OurTokensStore:
            check_valid(token):
                Checks if a token is present in the data cache.
        """
-    def __init__(self):
-        self.data = LRUCache(capacity=5000, max_age=86400)  # max age is in seconds
-        self.session_state = LRUCache(capacity=5000, max_age=86400)  # max age is in seconds
-        self.user_stor = LRUCache(capacity=5000, max_age=86400)  # max age is in seconds
+    def __init__(self, capacity=5000, max_age=86400, shards=16, path=None, backend=None):
+        if backend is None:
+            path = path or os.environ.get(TOKENS_STORE_PATH_ENV)
+            if path:
+                backend = SQLiteBackend(path, max_age=max_age, cache_capacity=capacity)
+            else:
+                backend = MemoryBackend(capacity=capacity, max_age=max_age, shards=shards)  # max age is in seconds
+        self.backend = backend
+        self.data = backend.namespace('tokens')
+        self.session_state = backend.namespace('session_state')
+        self.user_stor = backend.namespace('user_state')
 
     def add(self, token):
-        if token not in self.data:
-            self.data[token] = datetime.now()
+        self.data.setdefault(token, datetime.now())
 
     def get_user_state(self, user_id):
-        if user_id and user_id in self.user_stor:
-            return self.user_stor[user_id]
-        else:
-            return None
+        state = self.user_stor.get(user_id) if user_id else None
+        return FrozenState.of(state) if state is not None else None
 
     def set_user_state(self, user_id):
-        if user_id not in self.user_stor:
-            self.user_stor[user_id] = {}
+        self.user_stor.setdefault(user_id, FrozenState())
 
     def set_user_data(self, user_id, key, value):
-        local_state = self.get_user_state(user_id)
-        if local_state is None:
-            local_state = {}
-            self.user_stor[user_id] = local_state
-        local_state[key] = value
-        self.user_stor[user_id] = local_state
+        self.update_user_state(user_id, lambda state: state.set(key, value))
+
+    def update_user_state(self, user_id, fn):
+        """Atomically publishes fn(current snapshot) as the user state and returns it."""
+        return self.user_stor.update(user_id, lambda state: fn(FrozenState.of(state)), FrozenState)
 
     def get_user_data(self, user_id, key):
         user_state = self.get_user_state(user_id)
@@ -70,22 +87,18 @@ class OurTokensStore:
         return None
 
     def get_session_state(self, session_id):
-        if session_id and session_id in self.session_state:
-            return self.session_state[session_id]
-        else:
-            return None
+        state = self.session_state.get(session_id) if session_id else None
+        return FrozenState.of(state) if state is not None else None
 
     def set_session_state(self, session_id):
-        if session_id not in self.session_state:
-            self.session_state[session_id] = {}
+        self.session_state.setdefault(session_id, FrozenState())
 
     def set_session_data(self, session_id, key, value):
-        session_state = self.get_session_state(session_id)
-        if session_state is None:
-            session_state = {}
-            self.session_state[session_id] = session_state
-        session_state[key] = value
-        self.session_state[session_id] = session_state
+        self.update_session_state(session_id, lambda state: state.set(key, value))
+
+    def update_session_state(self, session_id, fn):
+        """Atomically publishes fn(current snapshot) as the session state and returns it."""
+        return self.session_state.update(session_id, lambda state: fn(FrozenState.of(state)), FrozenState)
 
     def get_session_data(self, session_id, key):
         session_state = self.get_session_state(session_id)
@@ -94,8 +107,7 @@ class OurTokensStore:
         return None
 
     def expire(self, token):
-        if token in self.data:
-            del self.data[token]
+        self.data.pop(token, None)
 
     def check_valid(self, token):
         if token in self.data:
@@ -6,6 +6,10 @@ import functools
 import ctypes
 import threading
 import inspect
+import heapq
+import itertools
+import collections
+from seedoo.streamlit.metrics import MetricsRegistry
 
 class ThreadInterrupted(Exception):
     pass
@@ -29,80 +33,340 @@ def safe_name(fn):
         return fn.func.__name__
     return fn.__name__
 
+
+class CancellationToken:
+    """
+    Cooperative cancellation flag for a task running on a TrackingThreadPoolExecutor.
+
+    Long running tasks should call `raise_if_cancelled()` between steps, or wait with `sleep()`,
+    so they stop at their deadline instead of being interrupted asynchronously.
+    """
+
+    def __init__(self, deadline=None):
+        self._event = threading.Event()
+        self.deadline = deadline  # time.monotonic() based, None means no deadline
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise ThreadInterrupted('Task was cancelled')
+
+    def sleep(self, seconds):
+        """Sleeps like time.sleep but raises ThreadInterrupted as soon as the task is cancelled."""
+        if self._event.wait(seconds):
+            raise ThreadInterrupted('Task was cancelled')
+
+
+_local = threading.local()
+
+
+def current_token():
+    """Returns the CancellationToken of the task running on this thread, or None outside of an executor task."""
+    return getattr(_local, 'token', None)
+
+
+_STAGE_CANCEL = 0  # Deadline reached, ask the task to stop
+_STAGE_INTERRUPT = 1  # Grace period over, interrupt the thread
+
+
+class _Task:
+    """Per-submission record, so timings and the thread id belong to the task and not to the wrapped function."""
+    __slots__ = ('name', 'timeout', 'token', 'thread_id', 'done', 'enqueue_time', 'start_time', 'end_time')
+
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+        self.enqueue_time = time.monotonic()
+        self.start_time = None
+        self.end_time = None
+        self.token = CancellationToken()
+        self.thread_id = None
+        self.done = False
+
+    @property
+    def queue_wait(self):
+        if self.start_time is None:
+            return None
+        return self.start_time - self.enqueue_time
+
+
 class TrackingThreadPoolExecutor(ThreadPoolExecutor):
-    def __init__(self, max_workers=None, thread_name_prefix='', timeout=10):
+    def __init__(self, max_workers=None, thread_name_prefix='', timeout=10, grace=1.0, report_interval=5,
+                 metrics=None, adaptive=False, min_workers=1, target_queue_wait_ms=50, window=1024):
         super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        # Adaptive mode moves a cap on running tasks between min_workers and max_workers based on observed
+        # queueing. Tasks over the cap wait in our own backlog, so the pool never starts more threads than
+        # the cap and its own bookkeeping is left alone.
+        self._adaptive = adaptive
+        self._min_workers = max(1, min(min_workers, self._max_workers))
+        self._cap = self._min_workers if adaptive else self._max_workers
+        self._admitted = 0
+        self._backlog = collections.deque()  # (future, fn, args, kwargs) of tasks waiting for the cap
+        self._target_queue_wait_ms = target_queue_wait_ms
+        self._queue_waits = collections.deque(maxlen=window)  # (start time, queue wait in ms) of recent tasks
+        self._last_adapt = time.monotonic()
         self._lock = Lock()
+        self._condition = threading.Condition(self._lock)
         self.logger = logging.getLogger(__name__)
-        self._futures = []
         self._timeout = timeout
+        self._grace = grace  # Seconds a cancelled task gets to stop on its own before it is interrupted
+        self._report_interval = report_interval
+        self._deadlines = []  # Heap of (deadline, sequence, stage, task)
+        self._sequence = itertools.count()
+        self._stale_deadlines = 0
+        self._outstanding = 0  # Submitted and not finished, queued tasks included
+        self._running = 0
         self._monitor_thread = Thread(target=self._monitor)
         self._monitor_thread.daemon = True
         self._monitor_thread.start()
 
 
     def submit(self, fn, *args, **kwargs):
-        wrapped_fn = self._wrap_fn(fn)
-        future = super().submit(wrapped_fn, *args, **kwargs)
+        return self.submit_with_timeout(self._timeout, fn, *args, **kwargs)
+
+    def submit_with_timeout(self, timeout, fn, /, *args, **kwargs):
+        """Submits fn with its own timeout in seconds, counted from when it starts running. None disables it."""
+        task = _Task(safe_name(fn), timeout)
+        with self._lock:
+            self._outstanding += 1
+        try:
+            if self._adaptive:
+                future = self._submit_admitted(self._wrap_fn(fn, task), args, kwargs)
+            else:
+                future = super().submit(self._wrap_fn(fn, task), *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._outstanding -= 1
+            raise
+        future.add_done_callback(self._task_finished)
+        self.logger.debug(f'Submitting task: {task.name} with args: {args} and kwargs: {kwargs}')
+        return future
+
+    def _task_finished(self, future):
+        with self._lock:
+            self._outstanding -= 1
+
+    def _submit_admitted(self, fn, args, kwargs):
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+        future = Future()
         with self._lock:
-            future._start_time = time.time()
-            self._futures.append((future, wrapped_fn))
-        self.logger.debug(f'Submitting task: {safe_name(fn)} with args: {args} and kwargs: {kwargs}')
+            self._backlog.append((future, fn, args, kwargs))
+        self._admit()
         return future
 
-    def _wrap_fn(self, fn):
+    def _admit(self):
+        # Hands backlog tasks to the pool while fewer than the cap are admitted
+        while True:
+            with self._lock:
+                if not self._backlog or self._admitted >= self._cap:
+                    return
+                item = self._backlog.popleft()
+                self._admitted += 1
+            self._submit_to_pool(item)
+
+    def _submit_to_pool(self, item):
+        queued = super().submit(self._run_admitted, *item)
+        # shutdown(cancel_futures=True) cancels the pool's work item, the caller holds our future
+        queued.add_done_callback(lambda done: done.cancelled() and item[0].cancel())
+
+    def _run_admitted(self, future, fn, args, kwargs):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+        finally:
+            with self._lock:
+                self._admitted -= 1
+            self._admit()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if self._adaptive:
+            with self._lock:
+                backlog, self._backlog = self._backlog, collections.deque()
+                self._admitted += len(backlog)
+            for item in backlog:
+                if cancel_futures:
+                    item[0].cancel()
+                else:
+                    # Queued in the pool so shutdown runs them like the tasks it already holds
+                    self._submit_to_pool(item)
+        super().shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def _wrap_fn(self, fn, task):
         @functools.wraps(fn)
         def wrapped(*args, **kwargs):
-            wrapped.thread_id = threading.get_ident()
-            wrapped._start_time = time.time()
+            start_time = time.monotonic()
+            delay = (start_time - task.enqueue_time) * 1000
+            (self.logger.info if delay < 5 else self.logger.warning)(f"Submit delay: {delay} ms for {task.name}")
+            self.metrics.observe('executor_queue_wait_ms', delay, function=task.name)
+            with self._lock:
+                task.start_time = start_time
+                task.thread_id = threading.get_ident()
+                self._running += 1
+                self._queue_waits.append((start_time, delay))
+                if task.timeout is not None:
+                    task.token.deadline = start_time + task.timeout
+                    self._schedule(task.token.deadline, _STAGE_CANCEL, task)
+            previous_token = getattr(_local, 'token', None)
+            _local.token = task.token
             try:
-                delay = (time.time() - wrapped._start_time) * 1000
-                (self.logger.info if delay < 5 else self.logger.warning)(f"Submit delay: {delay}")
-                result = fn(*args, **kwargs)
-                return result
-            except Exception as e:
-                raise e
+                return fn(*args, **kwargs)
+            finally:
+                _local.token = previous_token
+                end_time = time.monotonic()
+                self.metrics.observe('executor_run_ms', (end_time - start_time) * 1000, function=task.name)
+                with self._lock:
+                    task.end_time = end_time
+                    # Under the lock, so the monitor never interrupts this thread once the task is over
+                    task.done = True
+                    task.thread_id = None
+                    self._running -= 1
+                    if task.timeout is not None:
+                        self._stale_deadlines += 1
         return wrapped
 
+    def _schedule(self, deadline, stage, task):
+        # Called with self._lock held
+        wake_monitor = not self._deadlines or deadline < self._deadlines[0][0]
+        heapq.heappush(self._deadlines, (deadline, next(self._sequence), stage, task))
+        if wake_monitor:
+            self._condition.notify()
+
+    def _expire(self, now):
+        # Called with self._lock held
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, _, stage, task = heapq.heappop(self._deadlines)
+            if task.done:
+                self._stale_deadlines = max(0, self._stale_deadlines - 1)
+                continue
+            overrun = now - deadline
+            if stage == _STAGE_CANCEL:
+                self.logger.critical(f'Task {task.name} is running longer than {task.timeout} seconds and will be cancelled.')
+                task.token.cancel()
+                heapq.heappush(self._deadlines, (deadline + self._grace, next(self._sequence), _STAGE_INTERRUPT, task))
+            elif task.thread_id:
+                self.logger.critical(f'Task {task.name} ignored cancellation for {self._grace + overrun:.2f} seconds and will be interrupted.')
+                _async_raise(task.thread_id, ThreadInterrupted)
+            else:
+                self.logger.critical(f"Task {task.name} can not be interrupted because it doesn't have a thread id")
+
+        # Drop deadlines of finished tasks once they make up most of the heap, each rebuild removes at least
+        # half of it so the cost stays amortized and an idle pool ends up with an empty heap
+        if self._stale_deadlines and self._stale_deadlines > len(self._deadlines) // 2:
+            self._deadlines = [entry for entry in self._deadlines if not entry[3].done]
+            heapq.heapify(self._deadlines)
+            self._stale_deadlines = 0
+
+    def _report(self):
+        with self._lock:
+            running, outstanding = self._running, self._outstanding
+        # Queued tasks are not using a worker, so they are left out of the utilization
+        ratio = running / self._cap
+        (self.logger.debug if outstanding < 2 else self.logger.info)(f'{self._thread_name_prefix} executor, running tasks: {running}, queued tasks: {outstanding - running}')
 
+        (self.logger.warning if ratio > 0.5 else self.logger.debug)(f'{self._thread_name_prefix} executor utilization: {ratio:.2%}')
+
+    def queue_wait_percentiles(self, percentiles=(50, 90, 95, 99)):
+        """Returns {percentile: ms} of the queueing delay over the most recent tasks."""
+        return self._percentiles(percentiles)
+
+    def _percentiles(self, percentiles, since=None):
+        with self._lock:
+            waits = sorted(wait for start_time, wait in self._queue_waits if since is None or start_time >= since)
+        if not waits:
+            return {p: 0.0 for p in percentiles}
+        return {p: waits[min(len(waits) - 1, int(len(waits) * p / 100))] for p in percentiles}
+
+    def _adapt(self):
+        # Only look at tasks started since the previous decision, so old bursts do not keep the pool large
+        since, self._last_adapt = self._last_adapt, time.monotonic()
+        p95 = self._percentiles((95,), since)[95]
+        current = self._cap
+        if p95 > self._target_queue_wait_ms and current < self._max_workers:
+            # The pool starts the extra threads as the backlog is admitted
+            workers = min(self._max_workers, current + max(1, current // 4))
+        elif p95 < self._target_queue_wait_ms / 4 and self.active_threads < current // 2 and current > self._min_workers:
+            # Threads already started stay idle in the pool, fewer tasks are admitted to run at once
+            workers = max(self._min_workers, current - max(1, current // 4))
+        else:
+            return
+        self.logger.info(f'{self._thread_name_prefix} executor queue wait p95 {p95:.1f} ms, '
+                         f'resizing from {current} to {workers} workers')
+        self._resize(workers)
+
+    def _resize(self, workers):
+        with self._lock:
+            self._cap = workers
+        self._admit()
+
+    @property
+    def workers(self):
+        """Number of tasks allowed to run at once, below max_workers while an adaptive pool is scaled down."""
+        return self._cap
 
     def _monitor(self):
+        # Sleeps until the nearest deadline instead of scanning all tasks on a fixed interval
+        next_report = time.monotonic()
         while True:
-            self.logger.debug('Checking tasks for timeout...')
-            ratio = self.active_threads / self._max_workers
-            (self.logger.debug if self.active_threads < 2 else self.logger.info)(f'{self._thread_name_prefix} executor, active threads: {self.active_threads}')
-
-            (self.logger.warning if ratio > 0.5 else self.logger.debug)(f'{self._thread_name_prefix} executor utilization: {ratio:.2%}')
+            now = time.monotonic()
+            if now >= next_report:
+                self._report()
+                if self._adaptive:
+                    self._adapt()
+                next_report = now + self._report_interval
+            with self._condition:
+                now = time.monotonic()
+                self._expire(now)
+                wait_for = next_report - now
+                if self._deadlines:
+                    wait_for = min(wait_for, self._deadlines[0][0] - now)
+                if wait_for > 0:
+                    self._condition.wait(timeout=wait_for)
 
-            with self._lock:
-                for future, wrapped_fn in self._futures:
-                    self.logger.debug(f'Checking task: {future}')
-                    duration = (time.time() - future._start_time)
-                    if future.running():
-                        if duration > self._timeout:
-                            self.logger.critical(f'Task {future} is running for {duration} longer than {self._timeout} seconds and will be cancelled.')
-                            if wrapped_fn.thread_id:
-                                _async_raise(wrapped_fn.thread_id, ThreadInterrupted)
-                            else:
-                                self.logger.critical(f"Task {future} can not be canceled because it doesn't have a thread id")
-
-                        elif duration > self._timeout * 0.98:
-                            ratio = duration / self._timeout
-                            self.logger.warning(
-                                f'Task {future} is running for {duration} which is {ratio:.2%} of the timeout and will soon will be cancelled')
-
-                # Clean up completed futures
-                self._futures = [(f, wrapped_fn) for f, wrapped_fn in self._futures if not f.done()]
-            time.sleep(5)
+    def stats(self):
+        """Returns pool utilization and per-function queue wait and run time histograms in milliseconds."""
+        return {
+            'max_workers': self._max_workers,
+            'workers': self._cap,
+            'active_threads': self.active_threads,
+            'running_tasks': self.running_tasks,
+            'queue_wait_percentiles_ms': self.queue_wait_percentiles(),
+            'queue_wait_ms': self.metrics.stats('executor_queue_wait_ms')['executor_queue_wait_ms'],
+            'run_ms': self.metrics.stats('executor_run_ms')['executor_run_ms'],
+        }
 
     @property
     def active_threads(self):
         with self._lock:
-            return len(self._futures)
+            return self._outstanding
+
+    @property
+    def running_tasks(self):
+        """Number of tasks running on a worker thread right now, unlike active_threads without the queued ones."""
+        with self._lock:
+            return self._running
 
     @property
     def idling_threads(self):
-        return self._max_workers - self.active_threads
+        return self._cap - self.active_threads
 
 # Example usage
 def task(n):
@@ -114,6 +378,7 @@ def task(n):
         print('ThreadInterrupted called!')
         raise
 
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     max_workers = 5
@@ -121,7 +386,7 @@ if __name__ == "__main__":
     with TrackingThreadPoolExecutor(max_workers=max_workers, timeout=timeout) as executor:
         futures = [executor.submit(task, i) for i in range(10)]
         for future in as_completed(futures):
-            if future.cancelled():
+            if future.cancelled() or isinstance(future.exception(), ThreadInterrupted):
                 print(f'Task was cancelled due to timeout')
             else:
                 print(f'Completed task with result: {future.result()}')
@@ -0,0 +1,47 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+try:
+    from streamlit.runtime.scriptrunner.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+except ImportError:
+    from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+
+CONTEXT_POOL_WORKERS = 8
+
+_executor: Optional['ScriptContextThreadPoolExecutor'] = None
+_executor_lock = threading.Lock()
+
+
+class ScriptContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    Runs each task with the Streamlit script-run context of the thread that submitted it.
+
+    Unlike attaching a context to the pool threads once with add_script_run_ctx, the context follows
+    the task, so one pool can serve the reruns of every session.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(_run_with_context, get_script_run_ctx(), fn, args, kwargs)
+
+
+def _run_with_context(ctx, fn, args, kwargs):
+    thread = threading.current_thread()
+    previous = getattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+    setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+    add_script_run_ctx(thread, ctx)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, previous)
+
+
+def shared_context_executor() -> ScriptContextThreadPoolExecutor:
+    """Pool shared by all sessions for cell functions that run off the script thread."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ScriptContextThreadPoolExecutor(CONTEXT_POOL_WORKERS, thread_name_prefix='table_cells')
+        return _executor
@@ -4,19 +4,34 @@ import inspect
 import traceback
 
 import pandas as pd
-from typing import Callable, Dict, Optional, Union
+from typing import Callable, Dict, Hashable, Optional, Sequence, Union
+from seedoo.streamlit.utils.context_pool import shared_context_executor
+from seedoo.streamlit.utils.decorators import check_function_options
+from seedoo.streamlit.utils.filter_engine import FilterEngine
+from seedoo.streamlit.utils.handler_cache import HandlerCache
+from seedoo.streamlit.utils.table_source import TableSource
+from seedoo.streamlit.utils.page_prefetcher import session_prefetcher
 import logging
 import numpy as np
 import streamlit as st
 import pandas
 import functools
 import math
+import collections
+import threading
+import time
+from concurrent.futures import TimeoutError
 
 # Dictionary to store custom functions
 custom_functions: Dict[type, Dict[str, Union[Callable, Optional[Callable]]]] = {}
 
 
-def register_function(column_name: type, func: Callable, component: Optional[Callable] = None) -> None:
+# Shared by every session, holds the outputs of functions registered with cache=True
+handler_cache = HandlerCache()
+
+
+def register_function(column_name: type, func: Callable, component: Optional[Callable] = None, cache: bool = False,
+                      cache_row_fields: Sequence[str] = (), batch: bool = False, thread_safe: bool = False) -> None:
     global custom_functions
     """
     Registers a function and an optional component for a specific data type.
@@ -25,9 +40,33 @@ def register_function(column_name: type, func: Callable, component: Optional[Cal
         name (type): The data type to register the function for.
         func (Callable): The function to handle the data type.
         component (Optional[Callable]): An optional Streamlit component to display the processed data.
+        cache (bool): Memoize the function's output in `handler_cache`, keyed by the value, `disabled` and
+            `cache_row_fields`. Only allowed with a component, functions that build widgets must run every rerun.
+        cache_row_fields (Sequence[str]): Row fields the output depends on besides the value.
+        batch (bool): func takes (values: pd.Series, page: pd.DataFrame, disabled) with the whole visible slice of
+            a column and returns a list with one output per value. Batch functions of different columns run
+            concurrently on a pool thread, so they need a component and can not build widgets.
+        thread_safe (bool): func creates no Streamlit elements or widgets and may run on a pool thread, so
+            `process_dataframe(parallel=True)` runs it concurrently for the visible cells. Requires a component.
+
+    Raises:
+        ValueError: If cache, batch or thread_safe is set without a component, or cache and batch are both set.
     """
+    check_function_options(component, cache, batch, thread_safe)
+    custom_functions[column_name] = {'function': func, 'component': component,
+                                     'cache': tuple(cache_row_fields) if cache else None, 'batch': batch,
+                                     'thread_safe': thread_safe}
 
-    custom_functions[column_name] = {'function': func, 'component': component}
+
+def call_function(handler: Dict, value, row, disabled: bool):
+    """Calls a registered function, going through `handler_cache` when it was registered with cache=True."""
+    if handler.get('batch'):
+        # A batch function reached through per-value type dispatch, called with a one-value slice
+        page = row.series.to_frame().T
+        return handler['function'](pd.Series([value], index=page.index), page, disabled)[0]
+    if handler.get('cache') is None:
+        return handler['function'](value, row, disabled)
+    return handler_cache.get_or_compute(handler['function'], value, row, disabled, handler['cache'])
 
 
 def load_functions_with_decorator(package_root="seedoo.streamlit.module.default_module") -> Dict[
@@ -57,7 +96,10 @@ def load_functions_with_decorator(package_root="seedoo.streamlit.module.default_
                     for name, func in inspect.getmembers(module, inspect.isfunction):
                         if hasattr(func, '_column_type') or hasattr(func, '_column_name'):
                             key = func._column_type if hasattr(func, '_column_type') else func._column_name
-                            custom_functions[key] = {'function': func, 'component': func._component}
+                            custom_functions[key] = {'function': func, 'component': func._component,
+                                                     'cache': getattr(func, '_cache', None),
+                                                     'batch': getattr(func, '_batch', False),
+                                                     'thread_safe': getattr(func, '_thread_safe', False)}
 
 
 load_functions_with_decorator()
@@ -76,14 +118,22 @@ def pick_page(current_page: Optional[int] = None, key: str = '') -> None:
 
 
 def calculate_total_pages(df: pd.DataFrame, page_size: int) -> int:
-    total_rows = len(df)
-    if page_size == 0 or 0 == len(df):
+    return total_pages_for_rows(len(df), page_size)
+
+
+def total_pages_for_rows(total_rows: int, page_size: int) -> int:
+    if page_size == 0 or 0 == total_rows:
         return 10
     total_pages = math.ceil(total_rows / page_size)
     return total_pages
 
 
-def default_filter_callback(query: str, page_size: int, current_page: int, df: pd.DataFrame) -> pd.DataFrame:
+# Shared by every session, caches filtered row positions per (frame version, query) so page clicks only slice
+filter_engine = FilterEngine()
+
+
+def default_filter_callback(query: str, page_size: int, current_page: int,
+                            df: Union[pd.DataFrame, TableSource], data_version: Optional[Hashable] = None) -> pd.DataFrame:
     """
     Filters a DataFrame based on a query and returns a paginated subset.
 
@@ -91,19 +141,34 @@ def default_filter_callback(query: str, page_size: int, current_page: int, df: p
         query (str): The query string to filter the DataFrame.
         page_size (int): The number of rows per page.
         current_page (int): The current page number.
-        df (pd.DataFrame): The DataFrame to filter.
+        df (Union[pd.DataFrame, TableSource]): The DataFrame to filter, or a source to read the page from.
+        data_version (Optional[Hashable]): Changes whenever the DataFrame's content changes. With it the
+            matching rows are cached across reruns, without it the query is evaluated on every call.
 
     Returns:
         pd.DataFrame: The filtered and paginated DataFrame.
     """
     start_idx = current_page * page_size
-    end_idx = start_idx + page_size
-    total = calculate_total_pages(df, page_size)
-    if query:
-        filtered_df = df.query(query)
-        return [filtered_df.iloc[start_idx:end_idx], total]
-    else:
-        return [df.iloc[start_idx:end_idx], total]
+    if isinstance(df, TableSource):
+        return source_filter_callback(query, page_size, current_page, df)
+    page_df, total_rows = filter_engine.page(df, query, start_idx, page_size, data_version)
+    return [page_df, total_pages_for_rows(total_rows, page_size)]
+
+
+def source_filter_callback(query: str, page_size: int, current_page: int, source: TableSource) -> list:
+    """
+    Reads one page from a TableSource.
+
+    Returns [page_df, total_pages] when the source knows how many rows match the query, otherwise
+    [page_df, None, has_more] so render_pagination switches to Previous/Next pagination.
+    """
+    start_idx = current_page * page_size
+    total_rows = source.count(query)
+    if total_rows is not None:
+        return [source.page(start_idx, page_size, query), total_pages_for_rows(total_rows, page_size)]
+    # One extra row tells whether there is a next page
+    page_df = source.page(start_idx, page_size + 1, query)
+    return [page_df.iloc[:page_size], None, len(page_df) > page_size]
 
 
 def go_to_first_page(key):
@@ -203,29 +268,353 @@ def render_pagination(total_pages=None, has_more_data=True,
                             st.button(f"{page_num + 1}",use_container_width=True, key=f"page_{page_num}_clicked",
                                       on_click=functools.partial(pick_page, page_num, key_current_page))
 
+WIDTH_SAMPLE_SIZE = 100
+# Shared by the script threads of all sessions, guarded by _column_widths_lock
+_column_widths_cache: collections.OrderedDict = collections.OrderedDict()
+_column_widths_lock = threading.Lock()
+_COLUMN_WIDTHS_CACHE_SIZE = 256
+
+
+def decide_length(c: Union[pandas.core.frame.DataFrame, str, float, int, np.int64, np.float32]) -> float:
+    if isinstance(c, (pandas.core.frame.DataFrame,)):
+        return 2
+    elif isinstance(c, (str,)):
+        return 0.1
+    elif isinstance(c, (float, int, np.int64, np.float32)):
+        return 0.1
+    else:
+        return 1
+
+
+def _column_width(values: pd.Series) -> int:
+    if values.dtype != object:
+        # Numbers, booleans, dates and pandas strings all score 0.1 per value, which rounds up to the minimum width
+        return 1
+    sample = values.iloc[:WIDTH_SAMPLE_SIZE]
+    if sample.empty:
+        return 1
+    return max(1, int(np.rint(np.mean([decide_length(c) for c in sample.values]))))
+
+
+def estimate_column_widths(df: pd.DataFrame, col_names: list, cache_key=None) -> list:
+    """
+    Estimates relative column widths for st.columns from column dtypes and a bounded sample of values.
+
+    Args:
+        df (pd.DataFrame): The rows that are going to be rendered.
+        col_names (list): The columns to measure.
+        cache_key: Identifies the content of the source frame, e.g. its data version, results are cached per
+            cache key and schema so the widths stay the same across pages. None measures df every time.
+
+    Returns:
+        list: One integer width per column.
+    """
+    schema = tuple((c, str(df[c].dtype)) for c in col_names)
+    if cache_key is not None:
+        with _column_widths_lock:
+            cached = _column_widths_cache.get((cache_key, schema))
+            if cached is not None:
+                _column_widths_cache.move_to_end((cache_key, schema))
+                return cached
+
+    lengths = [_column_width(df[c]) for c in col_names]
+
+    if cache_key is not None:
+        with _column_widths_lock:
+            _column_widths_cache[(cache_key, schema)] = lengths
+            _column_widths_cache.move_to_end((cache_key, schema))
+            while len(_column_widths_cache) > _COLUMN_WIDTHS_CACHE_SIZE:
+                _column_widths_cache.popitem(last=False)
+    return lengths
+
+
+def virtual_window(df: pd.DataFrame, key: str, window_size: int = 20, overscan: int = 5) -> pd.DataFrame:
+    """
+    Renders the scroll position control and returns only the rows around it.
+
+    Args:
+        df (pd.DataFrame): The full (or filtered) DataFrame.
+        key (str): Session state key for the DataFrame, the scroll position is kept under key + 'scroll'.
+        window_size (int): Number of visible rows.
+        overscan (int): Extra rows kept above and below the visible rows.
+
+    Returns:
+        pd.DataFrame: The rows to build, off-screen rows are never touched.
+    """
+    total_rows = len(df)
+    max_position = max(0, total_rows - window_size)
+    key_scroll = key + 'scroll'
+    if max_position == 0:
+        position = 0
+    else:
+        if st.session_state.get(key_scroll, 0) > max_position:
+            st.session_state[key_scroll] = max_position
+        position = st.slider(f"Rows {total_rows}", min_value=0, max_value=max_position, step=1, key=key_scroll)
+    first = max(0, position - overscan)
+    last = min(total_rows, position + window_size + overscan)
+    return df.iloc[first:last]
+
+
+# dtype kinds whose values all convert to the same Python type, so one lookup serves the whole column
+_UNIFORM_KINDS = ('b', 'i', 'u', 'f', 'c')
+# Marks a column whose function has to be looked up from the type of each value
+PER_CELL = object()
+
+
+def build_dispatch_plan(df: pd.DataFrame, col_names: list, functions: Optional[Dict] = None) -> list:
+    """
+    Resolves the registered function of every column once per render.
+
+    Column name matches come first, then columns of a numeric or boolean dtype are resolved from the
+    type of their values. Other columns are resolved the same way when all their visible values have
+    one type, and are otherwise marked PER_CELL and dispatch on the type of each value.
+
+    Args:
+        functions (Optional[Dict]): Registered functions to resolve from, defaults to `custom_functions`.
+
+    Returns:
+        list: (column, values, function entry or None or PER_CELL) per column, values as Python objects.
+    """
+    functions = custom_functions if functions is None else functions
+    plan = []
+    for column in col_names:
+        series = df[column]
+        values = series.tolist()
+        if column in functions:
+            planned = functions[column]
+        elif isinstance(series.dtype, np.dtype) and series.dtype.kind in _UNIFORM_KINDS and values:
+            planned = functions.get(type(values[0]))
+        else:
+            types = set(map(type, values))
+            planned = functions.get(types.pop()) if len(types) == 1 else PER_CELL
+        plan.append((column, values, planned))
+    return plan
+
+
+def run_batch_functions(df: pd.DataFrame, plan: list, disabled: bool) -> Dict:
+    """
+    Calls the batch functions of the plan with their column slices, concurrently when there are several.
+
+    Returns:
+        Dict: column -> list of outputs, one per row of df.
+    """
+    batch_columns = [(column, planned) for column, _, planned in plan
+                     if planned is not None and planned is not PER_CELL and planned.get('batch')]
+
+    def run(column, handler):
+        outputs = list(handler['function'](df[column], df, disabled))
+        if len(outputs) != len(df):
+            raise ValueError(f"Batch function for column '{column}' returned {len(outputs)} outputs "
+                             f"for {len(df)} values")
+        return outputs
+
+    if len(batch_columns) <= 1:
+        return {column: run(column, handler) for column, handler in batch_columns}
+    executor = shared_context_executor()
+    futures = {column: executor.submit(run, column, handler) for column, handler in batch_columns}
+    return {column: future.result() for column, future in futures.items()}
+
+
+def runs_in_parallel(handler: Optional[dict]) -> bool:
+    """
+    Whether a registered function may run on a pool thread in parallel mode.
+
+    Args:
+        handler (dict): The registered function entry, or None.
+
+    Returns:
+        bool: True for functions registered with thread_safe=True that are not batched.
+    """
+    return handler is not None and bool(handler.get('thread_safe')) and not handler.get('batch')
+
+
+class ParallelCells:
+    """
+    Runs the functions of the visible cells on the context-aware pool while the script thread renders.
+
+    Cells are submitted in render order with at most `max_concurrency` running at once, and `result`
+    hands the outputs back in that same order so components are emitted on the script
+    thread exactly as in serial rendering. Only functions registered with thread_safe=True are
+    submitted, every other function keeps running on the script thread.
+    """
+
+    def __init__(self, cells: list, disabled: bool, max_concurrency: int = 8, timeout: Optional[float] = None):
+        self.disabled = disabled
+        self._executor = shared_context_executor()
+        # More tasks than pool threads would only queue, and queueing would count against the timeout
+        self.max_concurrency = max(1, min(max_concurrency, self._executor._max_workers))
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = collections.deque(cells)  # (cell key, function entry, value, row)
+        self._futures = {}  # cell key -> (submit time, Future)
+        self._running = 0
+        self._fill()
+
+    def _fill(self) -> None:
+        # Also called by the workers when they finish, so a slow cell does not hold back the ones after it
+        with self._lock:
+            while self._pending and self._running < self.max_concurrency:
+                cell_key, handler, value, row = self._pending.popleft()
+                self._running += 1
+                future = self._executor.submit(self._run, handler, value, row)
+                self._futures[cell_key] = (time.monotonic(), future)
+
+    def _run(self, handler: Dict, value, row):
+        try:
+            return call_function(handler, value, row, self.disabled)
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._fill()
+
+    def _cancel(self, future) -> None:
+        if future.cancel():
+            with self._lock:
+                self._running -= 1
+
+    def _take_pending(self, cell_key):
+        # Called with self._lock held, cells are asked for in order so the cell is usually the first one
+        for index, cell in enumerate(self._pending):
+            if cell[0] == cell_key:
+                del self._pending[index]
+                return cell
+        raise KeyError(cell_key)
+
+    def result(self, cell_key):
+        """
+        Returns the output of a cell, waiting at most until `timeout` seconds after it was submitted.
+
+        A cell that was not submitted yet, because timed out cells that already started still hold every
+        slot, is run on the calling thread instead.
+
+        Raises:
+            TimeoutError: If the function did not finish in time, it is cancelled if it has not started.
+        """
+        with self._lock:
+            entry = self._futures.pop(cell_key, None)
+            cell = self._take_pending(cell_key) if entry is None else None
+        if cell is not None:
+            _, handler, value, row = cell
+            return call_function(handler, value, row, self.disabled)
+        submitted, future = entry
+        if self.timeout is None:
+            return future.result()
+        try:
+            return future.result(timeout=max(0.0, submitted + self.timeout - time.monotonic()))
+        except TimeoutError:
+            self._cancel(future)
+            self._fill()
+            raise
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._pending.clear()
+            futures = [future for _, future in self._futures.values()]
+            self._futures.clear()
+        for future in futures:
+            self._cancel(future)
+
+
+def parallel_cells(plan: list, rows: list, disabled: bool, max_concurrency: int,
+                   timeout: Optional[float]) -> ParallelCells:
+    cells = []
+    for position, row in enumerate(rows):
+        for i, (column, values, planned) in enumerate(plan):
+            value = values[position]
+            handler = custom_functions.get(type(value)) if planned is PER_CELL else planned
+            if runs_in_parallel(handler):
+                cells.append(((position, i), handler, value, row))
+    return ParallelCells(cells, disabled, max_concurrency, timeout)
+
+
+class LazyRow:
+    """
+    Row passed to the registered functions, built only if a function needs more than the plain values.
+
+    Item access for rendered columns reads the already converted column values; anything else (other
+    columns, .name, .to_dict(), ...) goes to the `df.iloc[position]` Series, created on first use.
+    """
+
+    __slots__ = ('_df', '_position', '_values', '_series')
+
+    def __init__(self, df: pd.DataFrame, position: int, column_values: Dict):
+        self._df = df
+        self._position = position
+        self._values = column_values
+        self._series = None
+
+    @property
+    def series(self) -> pd.Series:
+        if self._series is None:
+            self._series = self._df.iloc[self._position]
+        return self._series
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key][self._position]
+        except (KeyError, TypeError):
+            return self.series[key]
+
+    def __getattr__(self, name):
+        return getattr(self.series, name)
+
+    def __contains__(self, key):
+        return key in self._df.columns
+
+    def __iter__(self):
+        return iter(self.series)
+
+    def __len__(self):
+        return len(self._df.columns)
+
+    def __repr__(self):
+        return repr(self.series)
+
+
 def process_dataframe(
-        df: pd.DataFrame,
+        df: Union[pd.DataFrame, TableSource],
         columns_length: Optional[list] = None,
         filter: bool = None,
         filter_callback: Optional[Callable[[str, int, int, pd.DataFrame], pd.DataFrame]] = default_filter_callback,
         key: str = "process_dataframe_key",
-        page_size_num: int = 5, strict=False, disabled: bool = False) -> None:
+        page_size_num: int = 5, strict=False, disabled: bool = False,
+        virtualized: bool = False, window_size: int = 20, overscan: int = 5, prefetch: int = 0,
+        parallel: bool = False, max_concurrency: int = 8, cell_timeout: Optional[float] = None,
+        data_version: Optional[Hashable] = None) -> None:
     global custom_functions
     """
     Processes each value in the DataFrame, passing it to a function based on the column's data type.
 
     Args:
-        df (pd.DataFrame): The DataFrame to process.
+        df (Union[pd.DataFrame, TableSource]): The DataFrame to process, or a TableSource that is read one page
+            per rerun. Sources are always paginated.
         columns_length (Optional[list]): List of column lengths.
         filter (bool): Whether to apply filtering.
         filter_callback (Optional[Callable[[str, int, int, pd.DataFrame], pd.DataFrame]]): Callback for filtering the DataFrame.
         key (str): Session state key for the DataFrame.
         page_size_num (int): Number of rows per page.
+        virtualized (bool): Only build the rows around the scroll position instead of the whole frame.
+        window_size (int): Number of visible rows in virtualized mode.
+        overscan (int): Extra rows built above and below the visible window in virtualized mode.
+        prefetch (int): Number of pages before and after the current one computed in the background
+            after each render, 0 disables prefetching.
+        parallel (bool): Run the functions of the visible cells concurrently on a pool carrying the session's
+            script-run context. Only functions registered with thread_safe=True run on the pool, components are
+            still emitted in order on the script thread and every other function stays serial.
+        max_concurrency (int): Maximum number of cell functions running at once in parallel mode, bounded by
+            the size of the shared pool.
+        cell_timeout (Optional[float]): Seconds a cell function may take in parallel mode before the cell shows a
+            warning instead (or raises TimeoutError when strict).
+        data_version (Optional[Hashable]): A value that changes whenever the DataFrame's content changes, e.g. a
+            file's modification time or a counter bumped by the code editing the frame. With it, the default
+            filter callback caches the matching rows across reruns and prefetching identifies the frame without
+            hashing it; without it, queries are evaluated on every rerun.
 
     Returns:
         None
     """
     logger = logging.getLogger(__name__)
+    source_df = df
     key_page_size = key + 'PAGE_SIZE'
 
     key_current_page = key + 'current_page'
@@ -235,15 +624,25 @@ def process_dataframe(
     else:
         PAGE_SIZE = st.session_state[key_page_size]
     current_page = st.session_state.get(key_current_page, 0)
+    paginate = filter or isinstance(df, TableSource)
+    if data_version is not None and filter_callback is default_filter_callback:
+        filter_callback = functools.partial(default_filter_callback, data_version=data_version)
 
-    if filter:
+    if paginate:
 
         def change_input_one():
             go_to_first_page(key)
 
-        query = st.text_input("Enter your query (e.g., id == 54):", key=key + 'query', on_change=change_input_one)
+        if filter:
+            query = st.text_input("Enter your query (e.g., id == 54):", key=key + 'query', on_change=change_input_one)
+        else:
+            query = ''
         try:
-            result = filter_callback(query, PAGE_SIZE, current_page, df)
+            prefetcher = session_prefetcher() if prefetch else None
+            result = (prefetcher.get(key, source_df, query, current_page, PAGE_SIZE, data_version)
+                      if prefetcher else None)
+            if result is None:
+                result = filter_callback(query, PAGE_SIZE, current_page, df)
             if len(result) == 3:
                 df, total_pages, stop_page = result
             else:
@@ -253,29 +652,22 @@ def process_dataframe(
             st.error(f"Query failed: {traceback.format_exc()}")
             raise
 
+    if virtualized:
+        df = virtual_window(df, key, window_size, overscan)
+
     col_names = [c for c in df.columns.values if '_widget' not in c]
     handled_rows = 0
 
-    def decide_length(c: Union[pandas.core.frame.DataFrame, str, float, int, np.int64, np.float32]) -> float:
-        if isinstance(c, (pandas.core.frame.DataFrame,)):
-            return 2
-        elif isinstance(c, (str,)):
-            return 0.1
-        elif isinstance(c, (float, int, np.int64, np.float32)):
-            return 0.1
-        else:
-            return 1
-
-    lengths = []
-    for col in col_names:
-        lengths.append(np.rint(np.mean([decide_length(c) for c in df[col].values])))
-    lengths = np.array(lengths)
-    lengths = np.maximum(lengths, 1)
-    lengths[np.isnan(lengths)] = 1
-    lengths = lengths.astype('int').tolist()
-    col_names = [c for c in df.columns.values if '_widget' not in c]
     if columns_length:
         lengths = columns_length
+    else:
+        # df is already reduced to the rows being rendered, the cache keeps the widths of the first page measured
+        # for as long as the source's content is known to be the same
+        if isinstance(source_df, TableSource):
+            content = source_df.fingerprint()
+        else:
+            content = data_version
+        lengths = estimate_column_widths(df, col_names, cache_key=(key, content) if content is not None else None)
 
     columns = st.columns(lengths, gap='small')
     with st.container():
@@ -286,37 +678,53 @@ def process_dataframe(
                     st.text('')
                 else:
                     st.text(column_name)
-        with st.container():
-            for _, row in df.iterrows():
-                with st.container():
-                    columns = st.columns(lengths, gap='small')
-                    for i, column in enumerate(col_names):
-                        value = row[column]
-                        column_type = type(value)
-                        with columns[i]:
-                            if column in custom_functions:
-                                func = custom_functions[column]['function']
-                                component = custom_functions[column]['component']
-                                output = func(value, row, disabled)
-                                if component:
-                                    component(output)
-                                elif strict:
-                                    raise RuntimeError(f"Output for {value} in column {column}: {output}")
-
-                            elif column_type in custom_functions:
-                                func = custom_functions[column_type]['function']
-                                component = custom_functions[column_type]['component']
-                                output = func(value, row, disabled)
-                                if component:
-                                    component(output)
-                                elif strict:
-                                    raise RuntimeError(f"Output for {value} in column {column}: {output}")
-                            else:
-                                message = f"No registered function for processing type '{column_type.__name__}' in column '{column}'."
-                                st.write(message)
-                                logger.warning(message)
+        plan = build_dispatch_plan(df, col_names)
+        column_values = {column: values for column, values, _ in plan}
+        batch_outputs = run_batch_functions(df, plan, disabled)
+        rows = [LazyRow(df, position, column_values) for position in range(len(df))]
+        cells = parallel_cells(plan, rows, disabled, max_concurrency, cell_timeout) if parallel else None
+        try:
+            with st.container():
+                for position, row in enumerate(rows):
+                    with st.container():
+                        columns = st.columns(lengths, gap='small')
+                        for i, (column, values, planned) in enumerate(plan):
+                            value = values[position]
+                            handler = custom_functions.get(type(value)) if planned is PER_CELL else planned
+                            with columns[i]:
+                                if column in batch_outputs:
+                                    handler['component'](batch_outputs[column][position])
+                                elif handler is not None:
+                                    component = handler['component']
+                                    if cells is not None and runs_in_parallel(handler):
+                                        try:
+                                            output = cells.result((position, i))
+                                        except TimeoutError:
+                                            message = f"Function for column '{column}' did not finish in {cell_timeout} s."
+                                            st.warning(message)
+                                            logger.warning(message)
+                                            if strict:
+                                                raise
+                                            continue
+                                    else:
+                                        output = call_function(handler, value, row, disabled)
+                                    if component:
+                                        component(output)
+                                    elif strict:
+                                        raise RuntimeError(f"Output for {value} in column {column}: {output}")
+                                else:
+                                    message = f"No registered function for processing type '{type(value).__name__}' in column '{column}'."
+                                    st.write(message)
+                                    logger.warning(message)
+        except BaseException:
+            # Drops the functions of the cells not rendered yet, whatever stopped the rendering
+            if cells is not None:
+                cells.cancel()
+            raise
 
         columns = st.columns(10)
-        if filter:
-            print(len(df))
+        if paginate:
             render_pagination(total_pages,stop_page, key_current_page)
+            if prefetcher:
+                prefetcher.prefetch(key, filter_callback, source_df, query, current_page, PAGE_SIZE, prefetch,
+                                    total_pages, stop_page, data_version)
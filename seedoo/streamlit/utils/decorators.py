@@ -1,21 +1,45 @@
-from typing import Callable, Dict, Optional, Union
+from typing import Callable, Dict, Optional, Sequence, Union
+import functools
 import logging
 
-def type_matcher(column_type: type, component: Optional[Callable] = None) -> Callable:
+def check_function_options(component: Optional[Callable], cache: bool = False, batch: bool = False,
+                           thread_safe: bool = False) -> None:
+    # Without a component the function renders its own widgets, replaying a cached output would drop them
+    if cache and component is None:
+        raise ValueError("cache=True requires a component, functions that build widgets can not be cached")
+    # Batch functions may run on a pool thread, where widgets can not be created
+    if batch and component is None:
+        raise ValueError("batch=True requires a component, functions that build widgets can not run in batches")
+    if batch and cache:
+        raise ValueError("batch=True and cache=True can not be combined")
+    # Parallel cells run on pool threads, where widget ids would depend on scheduling
+    if thread_safe and component is None:
+        raise ValueError("thread_safe=True requires a component, functions that build widgets can not run in parallel")
+
+
+def type_matcher(column_type: type, component: Optional[Callable] = None, cache: bool = False,
+                 cache_row_fields: Sequence[str] = (), batch: bool = False, thread_safe: bool = False) -> Callable:
     """
     Decorator for marking a function with a column type and a corresponding Streamlit component.
 
     Args:
         column_type (type): The data type of the column that the function should process.
         component (Optional[Callable]): The Streamlit component for displaying the function's output.
+        cache (bool): Memoize the function's output per value, see `register_function`.
+        cache_row_fields (Sequence[str]): Row fields the output depends on besides the value.
+        batch (bool): The function takes (column slice Series, page DataFrame, disabled) and returns one output
+            per value, see `register_function`.
+        thread_safe (bool): The function may run on a pool thread in parallel mode, see `register_function`.
 
     Returns:
         Callable: The decorated function with added attributes _column_type and _component.
     """
 
-    def decorator(func: Callable) -> Callable:
+    check_function_options(component, cache, batch, thread_safe)
 
+    def decorator(func: Callable) -> Callable:
 
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             logger = logging.getLogger(__name__)
             try:
@@ -26,26 +50,37 @@ def type_matcher(column_type: type, component: Optional[Callable] = None) -> Cal
 
         wrapper._column_type = column_type
         wrapper._component = component
+        wrapper._cache = tuple(cache_row_fields) if cache else None
+        wrapper._batch = batch
+        wrapper._thread_safe = thread_safe
         return wrapper
 
     return decorator
 
 
-def column_name_matcher(column_name: str, component: Optional[Callable] = None) -> Callable:
+def column_name_matcher(column_name: str, component: Optional[Callable] = None, cache: bool = False,
+                        cache_row_fields: Sequence[str] = (), batch: bool = False, thread_safe: bool = False) -> Callable:
     """
     Decorator for marking a function with a column name and a corresponding Streamlit component.
 
     Args:
         column_name (str): The name of the column that the function should process.
         component (Optional[Callable]): The Streamlit component for displaying the function's output.
+        cache (bool): Memoize the function's output per value, see `register_function`.
+        cache_row_fields (Sequence[str]): Row fields the output depends on besides the value.
+        batch (bool): The function takes (column slice Series, page DataFrame, disabled) and returns one output
+            per value, see `register_function`.
+        thread_safe (bool): The function may run on a pool thread in parallel mode, see `register_function`.
 
     Returns:
         Callable: The decorated function with added attributes _column_name and _component.
     """
 
-    def decorator(func: Callable) -> Callable:
+    check_function_options(component, cache, batch, thread_safe)
 
+    def decorator(func: Callable) -> Callable:
 
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             logger = logging.getLogger(__name__)
             try:
@@ -56,6 +91,9 @@ def column_name_matcher(column_name: str, component: Optional[Callable] = None)
 
         wrapper._column_name = column_name
         wrapper._component = component
+        wrapper._cache = tuple(cache_row_fields) if cache else None
+        wrapper._batch = batch
+        wrapper._thread_safe = thread_safe
         return wrapper
 
 
@@ -0,0 +1,228 @@
+import ast
+import collections
+import logging
+import threading
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+INDEX_SORTED = 'sorted'
+INDEX_HASH = 'hash'
+
+_FLIPPED = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq}
+
+
+class _Unsupported(Exception):
+    pass
+
+
+class ColumnIndex:
+    """Sorted or hash index over one column, answering equality and (for sorted) range predicates with positions."""
+
+    def __init__(self, values: np.ndarray, kind: str = INDEX_SORTED):
+        self.kind = kind
+        if kind == INDEX_HASH:
+            self.groups = pd.Series(np.arange(len(values))).groupby(values, sort=False, dropna=True).indices
+        else:
+            valid = ~pd.isna(values)
+            self.order = np.flatnonzero(valid)[np.argsort(values[valid], kind='stable')]
+            self.sorted_values = values[self.order]
+
+    def lookup(self, op: type, value) -> np.ndarray:
+        if self.kind == INDEX_HASH:
+            if op is not ast.Eq:
+                raise _Unsupported('hash index only answers equality')
+            return np.sort(self.groups.get(value, np.empty(0, dtype=np.int64)))
+
+        try:
+            if op is ast.Eq:
+                lo = np.searchsorted(self.sorted_values, value, side='left')
+                hi = np.searchsorted(self.sorted_values, value, side='right')
+            elif op is ast.Lt:
+                lo, hi = 0, np.searchsorted(self.sorted_values, value, side='left')
+            elif op is ast.LtE:
+                lo, hi = 0, np.searchsorted(self.sorted_values, value, side='right')
+            elif op is ast.Gt:
+                lo, hi = np.searchsorted(self.sorted_values, value, side='right'), len(self.sorted_values)
+            elif op is ast.GtE:
+                lo, hi = np.searchsorted(self.sorted_values, value, side='left'), len(self.sorted_values)
+            else:
+                raise _Unsupported(f'operator {op.__name__} is not indexed')
+        except TypeError as exc:
+            raise _Unsupported(str(exc))
+        return np.sort(self.order[lo:hi])
+
+
+class FilterEngine:
+    """
+    Caches the row positions matching a query so paging through a filtered frame costs a slice.
+
+    Results are kept per (frame version, schema, query string) in an LRU bounded by entries and bytes.
+    The version is supplied by the caller and must change whenever the frame's content changes, so a
+    frame rebuilt on every rerun or copied out of `st.cache_data` still hits; without a version `page`
+    evaluates the query every time. When a query consists only of `column <op> literal` comparisons joined
+    with `and`, the columns registered with `add_index` answer their predicates from a sorted or hash
+    index instead of scanning the frame; everything else goes through `DataFrame.eval`.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 512 * 1024 * 1024,
+                 indexes: Optional[Dict[str, str]] = None, max_indexed_frames: int = 4):
+        self.logger = logging.getLogger(__name__)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_indexed_frames = max_indexed_frames
+        self.indexed_columns = dict(indexes or {})
+        self._lock = threading.Lock()
+        self._results = collections.OrderedDict()  # (fingerprint, query) -> positions
+        self._column_indexes = collections.OrderedDict()  # fingerprint -> {column: ColumnIndex}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def add_index(self, column: str, kind: str = INDEX_SORTED) -> None:
+        if kind not in (INDEX_SORTED, INDEX_HASH):
+            raise ValueError(f"Unknown index kind '{kind}', use '{INDEX_SORTED}' or '{INDEX_HASH}'")
+        self.indexed_columns[column] = kind
+
+    @staticmethod
+    def fingerprint(df: pd.DataFrame, version: Hashable) -> Tuple:
+        """Identifies a frame by the caller's version of its content and its schema."""
+        return version, df.shape, tuple(df.columns), tuple(map(str, df.dtypes))
+
+    def positions(self, df: pd.DataFrame, query: str, version: Hashable) -> np.ndarray:
+        """Returns the sorted positional indices of the rows matching query, cached for this version of df."""
+        fingerprint = self.fingerprint(df, version)
+        cache_key = (fingerprint, query)
+        with self._lock:
+            positions = self._results.get(cache_key)
+            if positions is not None:
+                self._results.move_to_end(cache_key)
+                self.hits += 1
+                return positions
+            self.misses += 1
+
+        positions = self._evaluate(df, query, fingerprint)
+        if len(df) < 2 ** 31:
+            positions = positions.astype(np.int32, copy=False)
+
+        with self._lock:
+            previous = self._results.pop(cache_key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._results[cache_key] = positions
+            self._bytes += positions.nbytes
+            while self._results and (len(self._results) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._results.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return positions
+
+    def page(self, df: pd.DataFrame, query: str, offset: int, limit: int,
+             version: Optional[Hashable] = None) -> Tuple[pd.DataFrame, int]:
+        """
+        Returns the rows [offset, offset + limit) of the filtered frame and the total number of matches.
+
+        Matches are cached only when a version is given, otherwise the query is evaluated on the whole frame.
+        """
+        if not query:
+            return df.iloc[offset:offset + limit], len(df)
+        positions = _eval_mask(df, query) if version is None else self.positions(df, query, version)
+        return df.iloc[positions[offset:offset + limit]], len(positions)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+            self._column_indexes.clear()
+            self._bytes = 0
+
+    def _column_index(self, df: pd.DataFrame, fingerprint: Tuple, column: str) -> ColumnIndex:
+        with self._lock:
+            indexes = self._column_indexes.get(fingerprint)
+            if indexes is not None and column in indexes:
+                self._column_indexes.move_to_end(fingerprint)
+                return indexes[column]
+        index = ColumnIndex(df[column].to_numpy(), self.indexed_columns[column])
+        with self._lock:
+            self._column_indexes.setdefault(fingerprint, {})[column] = index
+            self._column_indexes.move_to_end(fingerprint)
+            while len(self._column_indexes) > self.max_indexed_frames:
+                self._column_indexes.popitem(last=False)
+        return index
+
+    def _evaluate(self, df: pd.DataFrame, query: str, fingerprint: Tuple) -> np.ndarray:
+        candidates = None
+        rest = []
+        if self.indexed_columns:
+            try:
+                predicates = _split_conjunction(ast.parse(query, mode='eval').body)
+            except SyntaxError:
+                # pandas-only syntax such as backticks or @variables
+                predicates = None
+            # pandas gives & and | the precedence of `and` and `or`, so a split by Python precedence only
+            # holds when every part is a comparison of plain names and literals
+            if predicates is not None and all(_is_plain_comparison(predicate) for predicate in predicates):
+                for predicate in predicates:
+                    try:
+                        column, op, value = _simple_comparison(predicate, self.indexed_columns)
+                        matched = self._column_index(df, fingerprint, column).lookup(op, value)
+                        candidates = matched if candidates is None else np.intersect1d(candidates, matched,
+                                                                                        assume_unique=True)
+                    except _Unsupported:
+                        rest.append(predicate)
+
+        if candidates is None:
+            return _eval_mask(df, query)
+        if rest:
+            expression = ' and '.join(f'({ast.unparse(predicate)})' for predicate in rest)
+            candidates = candidates[_eval_mask(df.iloc[candidates], expression)]
+        return candidates
+
+
+def _eval_mask(df: pd.DataFrame, expression: str) -> np.ndarray:
+    mask = np.asarray(df.eval(expression))
+    if mask.dtype != bool:
+        raise ValueError(f"Query '{expression}' does not evaluate to booleans")
+    return np.flatnonzero(mask)
+
+
+def _split_conjunction(node):
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        return [part for value in node.values for part in _split_conjunction(value)]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+        return _split_conjunction(node.left) + _split_conjunction(node.right)
+    if isinstance(node, ast.Compare) and len(node.ops) > 1:
+        # a < col <= b becomes (a < col) and (col <= b)
+        operands = [node.left] + node.comparators
+        return [ast.Compare(left=operands[i], ops=[op], comparators=[operands[i + 1]])
+                for i, op in enumerate(node.ops)]
+    return [node]
+
+
+def _is_plain_comparison(node) -> bool:
+    if not isinstance(node, ast.Compare):
+        return False
+    for operand in [node.left] + node.comparators:
+        if isinstance(operand, ast.Name):
+            continue
+        try:
+            ast.literal_eval(operand)
+        except (ValueError, TypeError, SyntaxError):
+            return False
+    return True
+
+
+def _simple_comparison(node, indexed_columns):
+    if not isinstance(node, ast.Compare) or len(node.ops) != 1:
+        raise _Unsupported('not a single comparison')
+    left, op, right = node.left, type(node.ops[0]), node.comparators[0]
+    if op not in _FLIPPED:
+        raise _Unsupported(f'operator {op.__name__} is not indexed')
+    if isinstance(right, ast.Name) and not isinstance(left, ast.Name):
+        left, right, op = right, left, _FLIPPED[op]
+    if not isinstance(left, ast.Name) or left.id not in indexed_columns:
+        raise _Unsupported('column is not indexed')
+    try:
+        value = ast.literal_eval(right)
+    except ValueError:
+        raise _Unsupported('right hand side is not a literal')
+    return left.id, op, value
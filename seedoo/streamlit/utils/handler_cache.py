@@ -0,0 +1,126 @@
+import collections
+import hashlib
+import pickle
+import threading
+import time
+import weakref
+from typing import Any, Callable, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class Uncacheable(Exception):
+    pass
+
+
+_handler_keys = weakref.WeakKeyDictionary()  # handler -> handler_key(handler), computed once per function object
+
+
+def value_key(value: Any):
+    """
+    Returns a hashable key for a cell value.
+
+    Hashable values are used as they are, tagged with their type so 1, 1.0 and True stay apart. Arrays
+    and frames are hashed by content, anything else by the digest of its pickle.
+    """
+    try:
+        hash(value)
+        return type(value), value
+    except TypeError:
+        pass
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        digest = hashlib.blake2b(np.ascontiguousarray(value).data, digest_size=16).digest()
+        return np.ndarray, value.dtype.str, value.shape, digest
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        try:
+            return type(value), tuple(value.shape), tuple(pd.util.hash_pandas_object(value, index=True))
+        except TypeError:
+            pass
+    try:
+        return 'pickle', hashlib.blake2b(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), digest_size=16).digest()
+    except Exception as e:
+        raise Uncacheable(f'{type(value).__name__} can not be hashed: {e}')
+
+
+def handler_key(handler: Callable):
+    """
+    Returns a key for a handler that stays the same across reruns.
+
+    Streamlit executes the script again on every rerun, so functions defined in it are new objects each
+    time. They are identified by their code and the values they close over instead.
+    """
+    try:
+        # None stands for the handler itself, a strong reference in the value would keep the key alive
+        return _handler_keys[handler] or handler
+    except (KeyError, TypeError):
+        pass
+    function = getattr(handler, '__wrapped__', handler)
+    code = getattr(function, '__code__', None)
+    key = None
+    if code is not None:
+        try:
+            closure = tuple(value_key(cell.cell_contents) for cell in function.__closure__ or ())
+            key = function.__module__, function.__qualname__, code, closure
+        except (Uncacheable, ValueError):
+            pass
+    try:
+        _handler_keys[handler] = key
+    except TypeError:
+        pass
+    return key or handler
+
+
+class HandlerCache:
+    """
+    Size-bounded LRU with a TTL for the outputs of cell handlers.
+
+    Outputs are keyed by (handler, value, disabled, row fields the handler declared it depends on).
+    Values that can not be hashed or pickled are computed without caching and counted as uncacheable.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (expires_at, output)
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    def get_or_compute(self, handler: Callable, value: Any, row: Any, disabled: bool,
+                       row_fields: Sequence[str] = ()) -> Any:
+        try:
+            key = (handler_key(handler), value_key(value), disabled) + tuple(value_key(row[field])
+                                                                              for field in row_fields)
+        except Uncacheable:
+            with self._lock:
+                self.uncacheable += 1
+            return handler(value, row, disabled)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        output = handler(value, row, disabled)
+
+        with self._lock:
+            self._entries[key] = (now + self.ttl, output)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return output
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'uncacheable': self.uncacheable}
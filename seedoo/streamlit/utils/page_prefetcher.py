@@ -0,0 +1,168 @@
+import collections
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Hashable, Optional
+
+import pandas as pd
+import streamlit as st
+
+SESSION_STATE_KEY = 'seedoo_page_prefetcher'
+PREFETCH_WORKERS = 4
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def shared_executor() -> ThreadPoolExecutor:
+    """Pool shared by the prefetchers of all sessions, so the number of prefetch threads does not grow with users."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix='page_prefetch')
+        return _executor
+
+
+class PagePrefetcher:
+    """
+    Computes the pages around the current one in the background and keeps them for the next rerun.
+
+    Results are kept in a bounded LRU keyed by (key, query, page, page size) and a page is handed out
+    once, so a rerun that stays on a page computes it again and shows rows changed since. Each table
+    key remembers the source, query and page size it was prefetched for; when one of them changes the
+    pending prefetches of that key are cancelled and its cached pages are dropped. Filter callbacks run
+    outside the script thread, so they must not call Streamlit elements.
+    """
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None, max_pages: int = 32):
+        self.logger = logging.getLogger(__name__)
+        self.executor = executor
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+        self._pages = collections.OrderedDict()  # (key, query, page, page_size) -> result or Future
+        self._states = {}  # key -> (source fingerprint, query, page_size)
+        self.hits = 0
+        self.misses = 0
+
+    def _check_state(self, key: str, fingerprint, query: str, page_size: int) -> None:
+        # Called with self._lock held
+        state = (fingerprint, query, page_size)
+        if self._states.get(key) == state:
+            return
+        self._states[key] = state
+        for cache_key in [k for k in self._pages if k[0] == key]:
+            entry = self._pages.pop(cache_key)
+            if isinstance(entry, Future):
+                entry.cancel()
+
+    def get(self, key: str, source, query: str, page: int, page_size: int,
+            version: Optional[Hashable] = None) -> Optional[list]:
+        """
+        Returns and forgets the filter callback result of a prefetched page, waiting for it if it is still
+        being computed.
+
+        Args:
+            version (Optional[Hashable]): Caller's version of a DataFrame source, see `source_fingerprint`.
+        """
+        cache_key = (key, query, page, page_size)
+        fingerprint = source_fingerprint(source, version)
+        with self._lock:
+            self._check_state(key, fingerprint, query, page_size)
+            entry = self._pages.pop(cache_key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+        if isinstance(entry, Future):
+            try:
+                entry = entry.result()
+            except Exception:
+                with self._lock:
+                    self.misses += 1
+                return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def _store(self, cache_key, entry) -> None:
+        self._pages[cache_key] = entry
+        self._pages.move_to_end(cache_key)
+        while len(self._pages) > self.max_pages:
+            _, evicted = self._pages.popitem(last=False)
+            if isinstance(evicted, Future):
+                evicted.cancel()
+
+    def prefetch(self, key: str, filter_callback: Callable, source, query: str, page: int, page_size: int,
+                 around: int = 1, total_pages: Optional[int] = None, has_more: bool = True,
+                 version: Optional[Hashable] = None) -> None:
+        """
+        Submits the pages page - around .. page + around that are not cached yet.
+
+        Args:
+            total_pages (Optional[int]): Upper bound for the pages, None in Previous/Next pagination.
+            has_more (bool): In Previous/Next pagination, whether there is any page after the current one.
+            version (Optional[Hashable]): Caller's version of a DataFrame source, see `source_fingerprint`.
+        """
+        pages = []
+        for distance in range(1, around + 1):
+            following = page + distance
+            if (total_pages is not None and following < total_pages) or (total_pages is None and has_more):
+                pages.append(following)
+            if page - distance >= 0:
+                pages.append(page - distance)
+
+        executor = self.executor or shared_executor()
+        fingerprint = source_fingerprint(source, version)
+        with self._lock:
+            self._check_state(key, fingerprint, query, page_size)
+            for target in pages:
+                cache_key = (key, query, target, page_size)
+                if cache_key in self._pages:
+                    continue
+                future = executor.submit(filter_callback, query, page_size, target, source)
+                future.add_done_callback(self._log_failure)
+                self._store(cache_key, future)
+
+    def cancel(self, key: str) -> None:
+        with self._lock:
+            self._states.pop(key, None)
+            for cache_key in [k for k in self._pages if k[0] == key]:
+                entry = self._pages.pop(cache_key)
+                if isinstance(entry, Future):
+                    entry.cancel()
+
+    def _log_failure(self, future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            # The page is computed again on the script thread, which reports the error to the user
+            self.logger.debug(f'Prefetch failed: {future.exception()!r}')
+
+
+def source_fingerprint(source, version: Optional[Hashable] = None):
+    """
+    Identifies the data behind a table across reruns.
+
+    st.cache_data hands every rerun a new copy of the same frame, so DataFrames are not identified by
+    object identity: by the caller's version of their content when there is one, otherwise by a hash of
+    the whole frame. Table sources are identified by what they read.
+    """
+    if isinstance(source, pd.DataFrame):
+        schema = source.shape, tuple(source.columns), tuple(map(str, source.dtypes))
+        if version is not None:
+            return schema + (version,)
+        try:
+            hashed = pd.util.hash_pandas_object(source, index=True)
+        except TypeError:
+            # Unhashable cells such as lists or dicts
+            hashed = pd.util.hash_pandas_object(source.astype(str), index=True)
+        return schema + (hashlib.blake2b(hashed.to_numpy().tobytes(), digest_size=16).digest(),)
+    fingerprint = getattr(source, 'fingerprint', None)
+    fingerprint = fingerprint() if fingerprint is not None else None
+    # The object itself is kept with its id, so the id can not be reused by another source meanwhile
+    return fingerprint if fingerprint is not None else (id(source), source)
+
+
+def session_prefetcher() -> PagePrefetcher:
+    """Returns the prefetcher of the current Streamlit session."""
+    if SESSION_STATE_KEY not in st.session_state:
+        st.session_state[SESSION_STATE_KEY] = PagePrefetcher()
+    return st.session_state[SESSION_STATE_KEY]
@@ -0,0 +1,271 @@
+import contextlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+
+class TableSource:
+    """
+    Rows behind a paginated `process_dataframe` table, read one page at a time.
+
+    Implementations only load the rows of the requested page, so datasets larger than RAM can be
+    browsed with constant memory per rerun. `count` may return None when the number of matching
+    rows is not known yet, the table then switches to Previous/Next pagination.
+    """
+
+    def count(self, query: str = '') -> Optional[int]:
+        raise NotImplementedError
+
+    def page(self, offset: int, limit: int, query: str = '') -> pd.DataFrame:
+        raise NotImplementedError
+
+    def schema(self) -> Dict[str, str]:
+        """Returns the column names mapped to their type names."""
+        raise NotImplementedError
+
+    def fingerprint(self) -> Optional[tuple]:
+        """
+        Identifies the rows behind the source across reruns, where a source built inline is a new object each time.
+
+        Returns None when the source can not tell, sources described by their arguments override it.
+        """
+        return None
+
+
+class ChunkedTableSource(TableSource):
+    """
+    Base for sources stored in independently readable chunks (Parquet row groups, Arrow record batches).
+
+    A page without a query reads only the chunks overlapping [offset, offset + limit). A page with a
+    query (pandas `DataFrame.query` syntax) filters chunk by chunk and remembers how many rows of each
+    chunk matched, so later pages skip the chunks before them without reading them again.
+    """
+
+    max_cached_queries = 32
+
+    def __init__(self, columns: Optional[Sequence[str]] = None):
+        self.columns = list(columns) if columns is not None else None
+        self._lock = threading.Lock()
+        self._match_counts: Dict[str, List[int]] = {}  # query -> matches of the chunks scanned so far
+        self._offsets = [0]
+        for rows in self._chunk_rows():
+            self._offsets.append(self._offsets[-1] + rows)
+
+    def _chunk_rows(self) -> List[int]:
+        raise NotImplementedError
+
+    def _read_chunks(self, chunks: List[int]) -> pa.Table:
+        raise NotImplementedError
+
+    def count(self, query: str = '') -> Optional[int]:
+        if not query:
+            return self._offsets[-1]
+        with self._lock:
+            matches = self._match_counts.get(query)
+            if matches is not None and len(matches) == len(self._offsets) - 1:
+                return sum(matches)
+        return None
+
+    def page(self, offset: int, limit: int, query: str = '') -> pd.DataFrame:
+        if not query:
+            return self._slice(offset, limit)
+
+        with self._lock:
+            matches = list(self._match_counts.get(query, []))
+        frames = []
+        skipped = 0
+        needed = limit
+        for chunk in range(len(self._offsets) - 1):
+            if chunk < len(matches) and skipped + matches[chunk] <= offset:
+                skipped += matches[chunk]
+                continue
+            frame = self._read_chunks([chunk]).to_pandas()
+            frame.index = pd.RangeIndex(self._offsets[chunk], self._offsets[chunk + 1])
+            filtered = frame.query(query)
+            if chunk == len(matches):
+                matches.append(len(filtered))
+            start = max(0, offset - skipped)
+            skipped += len(filtered)
+            if start < len(filtered):
+                frames.append(filtered.iloc[start:start + needed])
+                needed -= len(frames[-1])
+            if needed <= 0:
+                break
+
+        with self._lock:
+            if len(matches) > len(self._match_counts.get(query, [])):
+                self._match_counts.pop(query, None)
+                self._match_counts[query] = matches
+                while len(self._match_counts) > self.max_cached_queries:
+                    self._match_counts.pop(next(iter(self._match_counts)))
+        if not frames:
+            return self._empty()
+        return pd.concat(frames)
+
+    def _slice(self, offset: int, limit: int) -> pd.DataFrame:
+        total = self._offsets[-1]
+        end = min(offset + limit, total)
+        if offset >= end:
+            return self._empty()
+        chunks = [chunk for chunk in range(len(self._offsets) - 1)
+                  if self._offsets[chunk] < end and self._offsets[chunk + 1] > offset]
+        table = self._read_chunks(chunks)
+        frame = table.slice(offset - self._offsets[chunks[0]], end - offset).to_pandas()
+        frame.index = pd.RangeIndex(offset, end)
+        return frame
+
+    def _empty(self) -> pd.DataFrame:
+        return self._read_chunks([]).to_pandas()
+
+
+class ParquetSource(ChunkedTableSource):
+    """Reads only the row groups and columns of the requested page from a Parquet file."""
+
+    def __init__(self, path: str, columns: Optional[Sequence[str]] = None):
+        self.path = path
+        self.file = pq.ParquetFile(path, memory_map=True)
+        super().__init__(columns)
+
+    def _chunk_rows(self) -> List[int]:
+        metadata = self.file.metadata
+        return [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+
+    def _read_chunks(self, chunks: List[int]) -> pa.Table:
+        if not chunks:
+            return self.file.schema_arrow.empty_table().select(self.columns or self.file.schema_arrow.names)
+        return self.file.read_row_groups(chunks, columns=self.columns)
+
+    def fingerprint(self) -> tuple:
+        return type(self), self.path, tuple(self.columns or ())
+
+    def schema(self) -> Dict[str, str]:
+        schema = self.file.schema_arrow
+        return {name: str(schema.field(name).type) for name in (self.columns or schema.names)}
+
+
+class FeatherSource(ChunkedTableSource):
+    """
+    Memory-maps an Arrow IPC (Feather v2) file, a page only touches the pages of the mapping it slices.
+
+    Compressed files have to be decompressed on read, write them with compression='uncompressed'
+    to keep reads zero-copy.
+    """
+
+    def __init__(self, path: str, columns: Optional[Sequence[str]] = None):
+        self.path = path
+        self.reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+        super().__init__(columns)
+
+    def _chunk_rows(self) -> List[int]:
+        return [self.reader.get_batch(i).num_rows for i in range(self.reader.num_record_batches)]
+
+    def _read_chunks(self, chunks: List[int]) -> pa.Table:
+        table = pa.Table.from_batches([self.reader.get_batch(i) for i in chunks], schema=self.reader.schema)
+        return table.select(self.columns) if self.columns else table
+
+    def fingerprint(self) -> tuple:
+        return type(self), self.path, tuple(self.columns or ())
+
+    def schema(self) -> Dict[str, str]:
+        schema = self.reader.schema
+        return {name: str(schema.field(name).type) for name in (self.columns or schema.names)}
+
+
+class SQLiteSource(TableSource):
+    """
+    Pages through a SQLite table with LIMIT/OFFSET.
+
+    Queries are SQL WHERE clauses evaluated by SQLite. The database is opened read-only, so a query
+    typed into the table filter can not modify it, and statements built from a query run under an
+    authorizer that only lets them read `table`, so subqueries and UNIONs can not reach other tables.
+    `order_by` is a column of the table (or rowid), optionally followed by ASC or DESC. Counts are cached
+    per query until `PRAGMA data_version` shows that another connection committed to the database.
+    """
+
+    max_cached_queries = 256
+
+    def __init__(self, path: str, table: str, columns: Optional[Sequence[str]] = None, order_by: str = 'rowid'):
+        self.path = path
+        self.table = table
+        self.columns = list(columns) if columns is not None else None
+        self.order_by = order_by
+        self._lock = threading.Lock()
+        # Streamlit reruns on different threads, the lock serializes access to the shared connection
+        self._connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self._counts: Dict[str, int] = {}
+        self._data_version = None
+        self._order_by = self._order_clause(order_by)
+
+    def _order_clause(self, order_by: str) -> str:
+        name, _, direction = order_by.strip().partition(' ')
+        direction = direction.strip().upper()
+        columns = {column.lower() for column in self.schema()}
+        if name.lower() not in columns | {'rowid'} or direction not in ('', 'ASC', 'DESC'):
+            raise ValueError(f"order_by must be a column of '{self.table}' optionally followed by ASC or DESC, "
+                             f"got '{order_by}'")
+        return f'{_quote(name)} {direction}'.rstrip()
+
+    def _authorize(self, action, arg1, arg2, db_name, trigger):
+        if action == sqlite3.SQLITE_READ:
+            return sqlite3.SQLITE_OK if arg1.lower() == self.table.lower() else sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK if action in _QUERY_ACTIONS else sqlite3.SQLITE_DENY
+
+    @contextlib.contextmanager
+    def _restricted(self):
+        # Called with self._lock held, around statements containing a query typed by the user
+        self._connection.set_authorizer(self._authorize)
+        try:
+            yield
+        finally:
+            self._connection.set_authorizer(None)
+
+    def _select(self) -> str:
+        columns = ', '.join(_quote(c) for c in self.columns) if self.columns else '*'
+        return f'SELECT {columns} FROM {_quote(self.table)}'
+
+    def count(self, query: str = '') -> Optional[int]:
+        with self._lock:
+            # The connection is read-only, so every change of data_version is a commit of another connection
+            version = self._connection.execute('PRAGMA data_version').fetchone()[0]
+            if version != self._data_version:
+                self._data_version = version
+                self._counts.clear()
+            if query not in self._counts:
+                if len(self._counts) >= self.max_cached_queries:
+                    self._counts.clear()
+                where = f' WHERE {query}' if query else ''
+                with self._restricted():
+                    self._counts[query] = self._connection.execute(
+                        f'SELECT COUNT(*) FROM {_quote(self.table)}{where}').fetchone()[0]
+            return self._counts[query]
+
+    def page(self, offset: int, limit: int, query: str = '') -> pd.DataFrame:
+        where = f' WHERE {query}' if query else ''
+        sql = f'{self._select()}{where} ORDER BY {self._order_by} LIMIT ? OFFSET ?'
+        with self._lock, self._restricted():
+            frame = pd.read_sql_query(sql, self._connection, params=(limit, offset))
+        frame.index = pd.RangeIndex(offset, offset + len(frame))
+        return frame
+
+    def fingerprint(self) -> tuple:
+        return type(self), self.path, self.table, tuple(self.columns or ()), self.order_by
+
+    def schema(self) -> Dict[str, str]:
+        with self._lock:
+            rows = self._connection.execute(f'PRAGMA table_info({_quote(self.table)})').fetchall()
+        types = {row[1]: row[2] for row in rows}
+        return {name: types[name] for name in (self.columns or types)}
+
+
+# Authorizer actions a page or count statement needs besides reading its table
+_QUERY_ACTIONS = frozenset((sqlite3.SQLITE_SELECT, sqlite3.SQLITE_FUNCTION))
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
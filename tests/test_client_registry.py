@@ -0,0 +1,29 @@
+import asyncio
+
+from seedoo.streamlit.client_registry import ClientReadinessRegistry
+
+
+def test_timed_out_waits_leave_nothing_behind():
+    async def scenario():
+        registry = ClientReadinessRegistry()
+        for _ in range(50):
+            assert await registry.wait('/ws/never', timeout=0.001) is None
+        return registry
+
+    registry = asyncio.run(scenario())
+    assert registry._futures == {} and registry._waiters == {}
+
+
+def test_waiters_wake_when_the_client_connects():
+    async def scenario():
+        registry = ClientReadinessRegistry()
+        websocket = object()
+        waiting = asyncio.create_task(registry.wait('/ws/client', timeout=5))
+        for _ in range(10):
+            assert await registry.wait('/ws/client', timeout=0.001) is None
+        await asyncio.to_thread(registry.mark_ready, '/ws/client', websocket)
+        assert await waiting is websocket
+        assert registry.ready_client('/ws/client') is websocket
+        assert registry._waiters == {}
+
+    asyncio.run(scenario())
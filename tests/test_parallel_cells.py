@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from seedoo.streamlit.utils.data_processor import ParallelCells, parallel_cells
+
+
+def slow(value, row, disabled):
+    time.sleep(0.5)
+    return value
+
+
+def handler(function):
+    return {'function': function, 'component': print, 'cache': None, 'thread_safe': True}
+
+
+def test_cells_after_a_timeout_still_render_when_no_slot_is_free():
+    # The timed out cell has already started, so it holds the only slot until it finishes
+    cells = ParallelCells([((0, 0), handler(slow), 0, None), ((1, 0), handler(slow), 1, None)],
+                          disabled=False, max_concurrency=1, timeout=0.1)
+    with pytest.raises(TimeoutError):
+        cells.result((0, 0))
+    assert cells.result((1, 0)) == 1
+
+
+def test_results_come_back_in_render_order():
+    cells = ParallelCells([((i, 0), handler(lambda value, row, disabled: value * 2), i, None) for i in range(20)],
+                          disabled=False, max_concurrency=4)
+    assert [cells.result((i, 0)) for i in range(20)] == [i * 2 for i in range(20)]
+
+
+def test_cancel_drops_pending_cells():
+    cells = ParallelCells([((i, 0), handler(slow), i, None) for i in range(3)], disabled=False, max_concurrency=1)
+    cells.cancel()
+    with pytest.raises(KeyError):
+        cells.result((2, 0))
+
+
+def test_functions_not_registered_thread_safe_stay_on_the_script_thread():
+    widget = {'function': lambda value, row, disabled: value, 'component': print, 'cache': None}
+    plan = [('a', [1, 2], handler(lambda value, row, disabled: value)), ('b', [3, 4], widget)]
+    cells = parallel_cells(plan, [None, None], disabled=False, max_concurrency=2, timeout=None)
+    assert [cells.result((position, 0)) for position in range(2)] == [1, 2]
+    with pytest.raises(KeyError):
+        cells.result((0, 1))
+
+
+def widget_app():
+    import pandas as pd
+    import streamlit as st
+
+    from seedoo.streamlit.utils.data_processor import process_dataframe, register_function
+
+    register_function('label', lambda value, row, disabled: st.button(value, key=f'button-{value}'), st.write)
+    register_function('n', lambda value, row, disabled: value, st.text, thread_safe=True)
+    frame = pd.DataFrame({'label': [f'b{i}' for i in range(20)], 'n': list(range(20))})
+    process_dataframe(frame, key='widgets', page_size_num=20, parallel=True, max_concurrency=8)
+
+
+def test_parallel_mode_keeps_widget_building_functions_serial():
+    at = AppTest.from_function(widget_app, default_timeout=30).run()
+    assert not at.exception
+    assert [button.label for button in at.button] == [f'b{i}' for i in range(20)]
+    assert [text.value for text in at.text][-20:] == [str(i) for i in range(20)]
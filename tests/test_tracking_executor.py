@@ -0,0 +1,74 @@
+import logging
+import time
+
+from seedoo.streamlit.tracking_executor import TrackingThreadPoolExecutor, current_token
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_task_past_its_deadline_gets_its_token_cancelled():
+    tokens = []
+
+    def overrun():
+        tokens.append(current_token())
+        time.sleep(0.5)
+        return 'finished'
+
+    with TrackingThreadPoolExecutor(max_workers=2, grace=5) as executor:
+        future = executor.submit_with_timeout(0.1, overrun)
+        assert wait_until(lambda: tokens and tokens[0].cancelled, timeout=0.4)
+        assert future.result() == 'finished'
+
+
+def test_cooperative_task_exits_on_cancelled_token():
+    def cooperative():
+        steps = 0
+        while not current_token().cancelled:
+            steps += 1
+            time.sleep(0.01)
+        return steps
+
+    with TrackingThreadPoolExecutor(max_workers=2, grace=5) as executor:
+        start = time.monotonic()
+        assert executor.submit_with_timeout(0.1, cooperative).result(timeout=2) > 0
+        assert time.monotonic() - start < 1
+
+
+def test_tasks_without_timeout_get_no_token_deadline():
+    with TrackingThreadPoolExecutor(max_workers=2) as executor:
+        token = executor.submit_with_timeout(None, current_token).result()
+        assert token.deadline is None and not token.cancelled
+        assert executor._deadlines == []
+
+
+def test_finished_tasks_leave_no_deadlines_behind():
+    with TrackingThreadPoolExecutor(max_workers=4, report_interval=0.05) as executor:
+        # Short deadlines are popped when they pass, long ones once they make up most of the heap
+        for timeout in (0.1, 60):
+            for future in [executor.submit_with_timeout(timeout, lambda: None) for _ in range(2000)]:
+                future.result()
+            assert wait_until(lambda: not executor._deadlines)
+            assert executor._stale_deadlines == 0
+
+
+def test_adaptive_cap_rises_under_load_and_falls_back_when_idle(caplog):
+    caplog.set_level(logging.DEBUG, logger='seedoo.streamlit.tracking_executor')
+    with TrackingThreadPoolExecutor(max_workers=16, min_workers=1, adaptive=True, target_queue_wait_ms=10,
+                                    report_interval=0.05) as executor:
+        assert executor.workers == 1
+        futures = [executor.submit(time.sleep, 0.02) for _ in range(300)]
+        assert wait_until(lambda: executor.workers > 4)
+        for future in futures:
+            future.result()
+        assert wait_until(lambda: executor.workers == 1)
+
+    utilization = [float(record.message.rsplit(' ', 1)[1].rstrip('%')) for record in caplog.records
+                   if 'utilization' in record.message]
+    assert utilization and max(utilization) <= 100